@@ -8,6 +8,7 @@ import flask_blog.applications.blog as blog_application
 
 import flask_blog.models as models
 import flask_blog.cli as cli
+import flask_blog.maintenance as maintenance
 
 
 def create_app(test_config = None):
@@ -19,6 +20,7 @@ def create_app(test_config = None):
             app.config[key] = value
 
     app.teardown_appcontext(models.close_connection)
+    app.after_request(models.report_queries)
 
     app.register_blueprint(auth_application.blueprint)
     app.register_blueprint(admin_application.blueprint)
@@ -40,5 +42,6 @@ def create_app(test_config = None):
             file.write(b'password')
 
         app.config['EMAIL_HOST'] = (None, sys.stdout)
-    
+
+    maintenance.start_sweeper(app)
     return app
@@ -27,26 +27,15 @@ def create_admin_user(username: str, email: str, password: str):
         click.echo(info)
         return
     
-    if models.users.get(username = username) is not None:
-        click.secho('ERROR ', fg='red', nl=False)
-        info = f'Failed to create a new user. Username {username} is already in use.\n'
-        click.echo(info)    
-        return
-
     if not utils.valid_email(email):
         click.secho('ERROR ', fg='red', nl=False)
         info = f'Failed to create a new user. Email address {email} is invalid.\n'
         click.echo(info)
         return
     
-    if models.users.get(email = email) is not None:
-        click.secho('ERROR ', fg='red', nl=False)
-        info = f'Failed to create a new user. Email address {email} is already in use.\n'
-        click.echo(info)    
-        return
-    
     password_hash = utils.generate_password_hash(password)
-    models.users.insert(
+    inserted = models.users.upsert(
+        None,
         username = username,
         email = email,
         password = password_hash,
@@ -54,5 +43,12 @@ def create_admin_user(username: str, email: str, password: str):
         is_admin = 1
         )
 
+    if not inserted:
+        in_use = f'Username {username}' if models.users.get(columns = ['id'], username = username) else f'Email address {email}'
+        click.secho('ERROR ', fg='red', nl=False)
+        info = f'Failed to create a new user. {in_use} is already in use.\n'
+        click.echo(info)    
+        return
+
     click.secho('OK ', fg='green', nl=False)
     click.echo(f'Created a new admin user: {username}\n')
@@ -22,7 +22,7 @@ blueprint = flask.Blueprint(
 @security.admin_only
 def index() -> types.Response:
     session = flask.g.session
-    user_list = models.users.get_all()
+    user_list = models.users.iter_all(columns = ['id', 'username', 'is_admin'])
     csrf_token = session.csrf_token.hex()
     return flask.render_template('admin.html', users=user_list, csrf_token=csrf_token)
 
@@ -32,7 +32,7 @@ def index() -> types.Response:
 def manage_user(userid: int) -> types.Response:
     session = flask.g.session
     csrf_token = session.csrf_token.hex()
-    user = models.users.get(id = userid)    
+    user = models.users.get(columns = ['id', 'username', 'email', 'is_verified'], id = userid)
     if user is None:
         return flask.redirect(flask.url_for('admin.index'))
     return flask.render_template('manage_user.html', user=user, csrf_token=csrf_token)
@@ -60,7 +60,7 @@ def edit_username(userid: int) -> types.Response:
         return flask.redirect(manage_url)    
     
     username = request.form.get('username', '')
-    if not security.valid_username(username) or models.users.get(username = username) is not None:
+    if not security.valid_username(username) or models.users.get(columns = ['id'], username = username) is not None:
         return flask.redirect(manage_url)
 
     with models.users.update(id = userid) as row:
@@ -91,7 +91,7 @@ def edit_email(userid: int) -> types.Response:
         return flask.redirect(manage_url)    
     
     email = request.form.get('email', '')
-    if not security.valid_email(email) or models.users.get(email = email) is not None:
+    if not security.valid_email(email) or models.users.get(columns = ['id'], email = email) is not None:
         return flask.redirect(manage_url)
 
     with models.users.update(id = userid) as row:
@@ -121,13 +121,12 @@ def delete_user(userid: int) -> types.Response:
     if not security.matching_tokens(src, cmp):
         return flask.redirect(manage_url)
 
-    row = models.sessions.get(user_id = userid)
-    if row is not None:
-        sessions.end_session(row.session_id)
+    with models.transaction():
+        sessions.end_user_sessions(userid)
 
-    models.otps.delete(user_id = userid)
-    models.posts.delete(author_id = userid)
-    models.users.delete(id = userid)
+        models.otps.delete(user_id = userid)
+        models.posts.delete(author_id = userid)
+        models.users.delete(id = userid)
     return flask.redirect(flask.url_for('admin.index'))
 
 
@@ -179,12 +178,11 @@ def make_admin(userid: int):
     if not security.matching_tokens(src, cmp):
         return flask.redirect(manage_url)
 
-    row = models.sessions.get(user_id = userid)
-    if row is not None:
-        sessions.end_session(row.session_id)
+    with models.transaction():
+        sessions.end_user_sessions(userid)
 
-    with models.users.update(id = userid) as row:
-        row.is_admin = 1
+        with models.users.update(id = userid) as row:
+            row.is_admin = 1
 
     return flask.redirect(flask.url_for('admin.index'))
 
@@ -51,14 +51,23 @@ def register() -> types.Response:
     if credentials is None:
         raise TypeError()
 
-    models.users.insert(
-        username = credentials.username,
-        email = credentials.email,
-        password = generate_password_hash(credentials.password)
-        )
+    password_hash = generate_password_hash(credentials.password)
+    with models.transaction():
+        inserted = models.users.upsert(
+            None,
+            username = credentials.username,
+            email = credentials.email,
+            password = password_hash
+            )
+        
+        # Registered by a concurrent request after the form was validated.
+        if not inserted:
+            flask.flash('Username or email is in use.')
+            return flask.render_template('register.html')
+        
+        user = models.users.get(username = credentials.username)
+        otp, expires = generate_otp(user.id, OTP.EMAIL, EMAIL_VERIFICATION_TOKEN_LIFETIME)
     
-    user = models.users.get(username = credentials.username)
-    otp, expires = generate_otp(user.id, OTP.EMAIL, EMAIL_VERIFICATION_TOKEN_LIFETIME)
     send_verification_email(user.email, otp, expires, request.url_root)
 
     login_url = flask.url_for('auth.login')
@@ -203,11 +212,30 @@ def reset_password() -> types.Response:
 
 @blueprint.before_app_request
 def load_user_session():
-    session_id = flask.session.pop(SESSIONID, None)
-    session = sessions.load_user_session(session_id)
-    
-    flask.session[SESSIONID] = session.id.hex()
+    session_id = flask.session.get(SESSIONID, None)
+    session, user = sessions.load_session_and_user(session_id)
     flask.g.session = session
     
     if not session.is_anonymous:
-        flask.g.user = models.users.get(id = session.user_id)
+        flask.g.user = user
+
+
+@blueprint.after_app_request
+def store_session_cookie(response: flask.Response) -> flask.Response:
+    """
+    Update the session cookie if the session has changed.
+    Anonymous sessions that were never stored don't get a cookie.
+    """
+    session = flask.g.get('session', None)
+    if session is None:
+        return response
+    
+    if session.is_stored:
+        cookie_value = sessions.session_cookie_value(session)
+        if flask.session.get(SESSIONID, None) != cookie_value:
+            flask.session[SESSIONID] = cookie_value
+    
+    elif SESSIONID in flask.session:
+        flask.session.pop(SESSIONID)
+    
+    return response
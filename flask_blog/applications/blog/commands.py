@@ -4,6 +4,7 @@ from flask.cli import with_appcontext
 
 import flask_blog.cli as cli
 import flask_blog.security as security
+import flask_blog.maintenance as maintenance
 import flask_blog.typing as types
 
 
@@ -33,6 +34,101 @@ def init_database():
 
 
 
+@cli.register
+@click.command('create-tables')
+@with_appcontext
+def create_tables():
+    try:
+        created = models.create_tables('flask_blog.schema')
+    
+    except Exception as err:
+        click.secho('ERROR ', fg='red', nl=False)
+        click.echo('Failed to create the tables.\n')
+        click.echo(str(err) + '\n')
+    
+    else:
+        click.secho('OK ', fg='green', nl=False)
+        click.echo(f'Created {len(created)} missing tables.\n')
+        for name in created:
+            click.echo(f'  {name}')
+
+
+
+@cli.register
+@click.command('create-indexes')
+@with_appcontext
+def create_indexes():
+    try:
+        created, skipped = models.create_indexes('flask_blog.schema')
+    
+    except Exception as err:
+        click.secho('ERROR ', fg='red', nl=False)
+        click.echo('Failed to create the indexes.\n')
+        click.echo(str(err) + '\n')
+    
+    else:
+        click.secho('OK ', fg='green', nl=False)
+        click.echo(f'Created {len(created)} missing indexes.\n')
+        for name in created:
+            click.echo(f'  {name}')
+        
+        if skipped:
+            click.echo(f'\nSkipped {len(skipped)} indexes of missing tables, run create-tables first.\n')
+            for name in skipped:
+                click.echo(f'  {name}')
+
+
+
+@cli.register
+@click.command('sweep-expired')
+@click.option('--batch-size', type=int, default=None, help='Rows scanned per batch.')
+@click.option('--pause', type=float, default=None, help='Seconds to sleep between the batches.')
+@with_appcontext
+def sweep_expired(batch_size: types.Optional[int], pause: types.Optional[float]):
+    config = flask.current_app.config
+    try:
+        results = maintenance.sweep_expired(
+            batch_size if batch_size is not None else config['SWEEPER_BATCH_SIZE'],
+            pause if pause is not None else config['SWEEPER_PAUSE']
+            )
+
+    except Exception as err:
+        click.secho('ERROR ', fg='red', nl=False)
+        click.echo('Failed to delete the expired rows.\n')
+        click.echo(str(err) + '\n')
+
+    else:
+        removed = sum(result.removed for result in results)
+        click.secho('OK ', fg='green', nl=False)
+        click.echo(f'Deleted {removed} expired rows.\n')
+        for result in results:
+            times = ', '.join(f'{seconds * 1000:.2f}' for seconds in result.batch_times)
+            click.echo(f'  {result}')
+            click.echo(f'    batch times (ms): {times}')
+
+
+
+@cli.register
+@click.command('migrate-timestamps')
+@with_appcontext
+def migrate_timestamps():
+    try:
+        migrated = maintenance.migrate_timestamps()
+
+    except Exception as err:
+        click.secho('ERROR ', fg='red', nl=False)
+        click.echo('Failed to migrate the timestamps. The tables migrated before the error stay migrated,\n')
+        click.echo('run the command again to migrate the rest.\n')
+        click.echo(str(err) + '\n')
+
+    else:
+        click.secho('OK ', fg='green', nl=False)
+        click.echo(f'Migrated {len(migrated)} tables to integer timestamps.\n')
+        for table, rows in migrated.items():
+            click.echo(f'  {table}: {rows} rows')
+
+
+
 @cli.register
 @click.command('create-user')
 @click.option('--username', prompt='Username')
@@ -46,26 +142,27 @@ def create_user(username: str, email: str, password: str):
         click.echo(info)
         return
     
-    if models.users.get(username = username) is not None:
-        click.secho('ERROR ', fg='red', nl=False)
-        info = f'Failed to create a new user. Username {username} is already in use.\n'
-        click.echo(info)    
-        return
-
     if not security.valid_email(email):
         click.secho('ERROR ', fg='red', nl=False)
         info = f'Failed to create a new user. Email address {email} is invalid.\n'
         click.echo(info)
         return
     
-    if models.users.get(email = email) is not None:
+    password_hash = security.generate_password_hash(password)
+    inserted = models.users.upsert(
+        None,
+        username = username,
+        email = email,
+        password = password_hash,
+        is_verified = 1
+        )
+
+    if not inserted:
+        in_use = f'Username {username}' if models.users.get(columns = ['id'], username = username) else f'Email address {email}'
         click.secho('ERROR ', fg='red', nl=False)
-        info = f'Failed to create a new user. Email address {email} is already in use.\n'
+        info = f'Failed to create a new user. {in_use} is already in use.\n'
         click.echo(info)    
         return
-    
-    password_hash = security.generate_password_hash(password)
-    models.users.insert(username = username, email = email, password = password_hash, is_verified = 1)
 
     click.secho('OK ', fg='green', nl=False)
     click.echo(f'Created a new user: {username}\n')
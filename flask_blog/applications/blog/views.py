@@ -11,20 +11,41 @@ else:
     import flask_blog.models as models
 
 
+POSTS_PER_PAGE = 20
+
+
 blueprint = flask.Blueprint(
     'blog', __name__,
     template_folder=path_relative_to_file(__file__, 'templates')
     )
 
 
+@blueprint.app_template_filter('timestamp')
+def format_timestamp(value: types.Union[int, str]) -> str:
+    return str(Timestamp.load(value))
+
+
 @blueprint.route('/', methods=('GET',))
 @security.authentication_required
 def index() -> types.Response:
     user = flask.g.user
     session = flask.g.session
     csrf_token = session.csrf_token.hex()
-    post_list = models.posts.query(author_id = user.id)
-    return flask.render_template('blog.html', posts=post_list, csrf_token=csrf_token)
+    after = flask.request.args.get('after', None, type=int)
+    
+    post_list = models.posts.query(
+        author_id = user.id,
+        order_by = 'id',
+        after = after,
+        limit = POSTS_PER_PAGE + 1
+        )
+
+    next_page = None
+    if len(post_list) > POSTS_PER_PAGE:
+        post_list = post_list[:POSTS_PER_PAGE]
+        next_page = post_list[-1].id
+    
+    return flask.render_template('blog.html', posts=post_list, next_page=next_page, csrf_token=csrf_token)
 
 
 @blueprint.route('/create', methods=('POST',))
@@ -50,7 +71,7 @@ def create() -> types.Response:
 
     content = request.form['text']
     if content and not content.isspace():
-        models.posts.insert(author_id = user.id, content = content, created = str(Timestamp()))
+        models.posts.insert(author_id = user.id, content = content, created = int(Timestamp()))
 
     return flask.redirect(blog_url)
 
@@ -33,12 +33,36 @@ class Timestamp:
         self.month = date.month
         self.year = date.year
 
+    @classmethod
+    def from_epoch(cls, seconds: float):
+        date = datetime.datetime.fromtimestamp(seconds)
+        ts = cls()
+        ts.hours = date.hour
+        ts.minutes = date.minute
+        ts.day = date.day
+        ts.month = date.month
+        ts.year = date.year
+        return ts
+
+    @classmethod
+    def load(cls, value: typing.Union[int, str]):
+        """
+        Read a stored timestamp. Timestamps are stored as integer epoch seconds,
+        rows written before the 'migrate-timestamps' command was run
+        still contain the old 'HH:MM DD.MM.YYYY' strings.
+        """
+        if isinstance(value, int):
+            return cls.from_epoch(value)
+        if value.isdigit():
+            return cls.from_epoch(int(value))
+        return cls.from_str(value)
+
     @classmethod
     def from_str(cls, string):
         time, date = string.split(' ')
         hours, minutes = time.split(':')
         day, month, year = date.split('.')
-        ts = Timestamp()
+        ts = cls()
         ts.hours = int(hours)
         ts.minutes = int(minutes)
         ts.day = int(day)
@@ -110,6 +134,10 @@ class Timestamp:
         ]
         return all(comparisons)
 
+    def __int__(self):
+        date = datetime.datetime(self.year, self.month, self.day, self.hours, self.minutes)
+        return int(date.timestamp())
+
     def __str__(self):
         parts = [
             str(self.hours).zfill(2),
@@ -130,11 +158,19 @@ class Timestamp:
 
 class Session:
     def __init__(self, session_id: bytes, csrf_token: bytes, expires: Timestamp, user_id: int):
-        self.id = session_id
-        self.csrf_token = csrf_token
+        self._id = session_id
+        self._csrf_token = csrf_token
         self.expires = expires
         self.user_id = user_id
 
+    @property
+    def id(self) -> bytes:
+        return self._id
+
+    @property
+    def csrf_token(self) -> bytes:
+        return self._csrf_token
+
     @classmethod
     def from_dict(cls, dict_: dict) -> typing.Optional[object]:
         if not dict_:
@@ -143,7 +179,7 @@ class Session:
         session = Session(
             dict_['session_id'],
             dict_['csrf_token'],
-            Timestamp.from_str(dict_['expires']),
+            Timestamp.load(dict_['expires']),
             dict_['user_id'],
         )
         return session
@@ -156,9 +192,15 @@ class Session:
     def is_expired(self) -> bool:
         return Timestamp() > self.expires
 
+    @property
+    def is_stored(self) -> bool:
+        return True
+
 
 class Namespace:
 
+    __slots__ = ('data',)
+
     def __init__(self, data: dict):
         object.__setattr__(self, 'data', data)
     
@@ -17,4 +17,69 @@ EMAIL_CREDENTIALS = os.path.join(os.path.dirname(__file__), 'email-credentials')
 
 DATABASE = os.path.join(os.path.dirname(__file__), 'database.db')
 
+# Maximum number of pooled connections kept open for the whole process.
+# Set to 0 to open a new connection for every request.
+DATABASE_POOL_SIZE = 8
+
+# Maximum number of pooled read-only connections. Reads are routed to
+# these and writes to the connections above. Set to 0 to use
+# a single read-write connection per request.
+DATABASE_READ_POOL_SIZE = 8
+
+# Seconds to wait for a free pooled connection, None waits forever.
+DATABASE_POOL_TIMEOUT = 10.0
+
+# PRAGMA statements applied to every new connection.
+# 'performance' enables WAL journaling with relaxed syncing,
+# 'default' keeps the SQLite defaults. Individual pragmas
+# can be overridden with DATABASE_PRAGMAS, for example:
+# DATABASE_PRAGMAS = {'synchronous': 'FULL'}
+DATABASE_PRAGMA_PROFILE = 'performance'
+DATABASE_PRAGMAS: dict = {}
+
+# Report the number and duration of the SQL statements run during each request
+# in the X-Query-Count and X-Query-Time response headers and in the log.
+# None enables the report in debug mode only.
+DATABASE_QUERY_STATS = None
+
+# Log a warning when the same statement is run more than this many times in one request.
+DATABASE_QUERY_REPEAT_WARNING = 10
+
+# Log the statements slower than SLOW_QUERY_THRESHOLD seconds with their
+# query plans into this file. None disables the log.
+SLOW_QUERY_LOG = None
+SLOW_QUERY_THRESHOLD = 0.1
+SLOW_QUERY_LOG_MAX_BYTES = 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+
+# How the CSRF tokens of new sessions are generated:
+# 'hmac' (HMAC-SHA256 of the session id), 'random' or 'pbkdf2' (the slow
+# key derivation used by older versions). Can also be a callable
+# taking the session id and the secret key and returning bytes.
+CSRF_TOKEN_STRATEGY = 'hmac'
+
+# Where the sessions are kept: 'database' stores every session in the sessions
+# table, 'signed' keeps them in HMAC-signed cookies and only records the ended
+# sessions in the session_revocations table. With 'signed', the revocations are
+# cached in memory and reloaded after SESSION_REVOCATION_CACHE_TTL seconds,
+# so other processes see them with this delay. Databases created before the
+# session_revocations table was added get it with the 'create-tables' command.
+SESSION_BACKEND = 'database'
+SESSION_REVOCATION_CACHE_TTL = 5.0
+
+# Cache up to SESSION_CACHE_SIZE sessions loaded from the database for
+# SESSION_CACHE_TTL seconds in each process. 0 disables the cache. The sessions
+# ended in other processes are recorded in the session_revocations table and
+# dropped from the cache within SESSION_REVOCATION_CACHE_TTL seconds.
+SESSION_CACHE_SIZE = 1024
+SESSION_CACHE_TTL = 30.0
+
+# Delete the expired sessions, OTPs and session revocations every
+# SWEEPER_INTERVAL seconds in a background thread. None disables the thread,
+# the 'sweep-expired' command can be run from cron instead. The rows are
+# deleted SWEEPER_BATCH_SIZE at a time with SWEEPER_PAUSE seconds between the batches.
+SWEEPER_INTERVAL = None
+SWEEPER_BATCH_SIZE = 500
+SWEEPER_PAUSE = 0.05
+
 SECRET_KEY = 'development'
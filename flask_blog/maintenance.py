@@ -0,0 +1,195 @@
+"""
+Periodic removal of expired sessions, OTPs and session revocations.
+
+The expired rows are found with an index range scan on the expires column
+and deleted SWEEP_BATCH_SIZE rows at a time, each batch in its own transaction.
+The sweeper sleeps SWEEP_PAUSE seconds between the batches, so the other
+writers don't have to wait for the whole sweep.
+
+Run it with the 'sweep-expired' command, or set SWEEPER_INTERVAL
+to run it in a background thread of the application process.
+
+The expiry times must be stored as epoch seconds, databases created
+before that are converted with the 'migrate-timestamps' command.
+"""
+
+import threading
+import time
+import flask
+
+import flask_blog.typing as types
+from flask_blog.common import Timestamp
+
+if types.TYPE_CHECKING:
+    import flask_blog.models
+    models = types.cast(flask_blog.models.Module, flask_blog.models)
+else:
+    import flask_blog.models as models
+
+
+SWEEP_BATCH_SIZE = 500
+SWEEP_PAUSE = 0.05
+
+
+class SweepResult:
+    def __init__(self, table: str):
+        self.table = table
+        self.removed = 0
+        self.batch_times: types.List[float] = list()
+
+    @property
+    def total_time(self) -> float:
+        return sum(self.batch_times)
+
+    def __str__(self):
+        batches = len(self.batch_times)
+        return f'{self.table}: {self.removed} rows removed in {batches} batches, {self.total_time * 1000:.2f} ms'
+
+
+# The timestamp columns stored as 'HH:MM DD.MM.YYYY' strings before
+# they were changed to integer epoch seconds.
+TIMESTAMP_COLUMNS = {
+    'sessions': 'expires',
+    'otps': 'expires',
+    'posts': 'created',
+    }
+
+
+def pending_timestamp_migrations() -> types.List[str]:
+    """
+    Return the tables whose timestamp column is not an INTEGER column yet.
+    """
+    return [
+        table for table, column in TIMESTAMP_COLUMNS.items()
+        if models.table_schema(table).columns[column].upper() != 'INTEGER'
+        ]
+
+
+def epoch_seconds(value: types.Union[int, str]) -> int:
+    return int(Timestamp.load(value))
+
+
+def migrate_timestamps() -> types.Dict[str, int]:
+    """
+    Rebuild the tables with text timestamp columns with INTEGER columns
+    and convert the stored values to epoch seconds.
+
+    The tables missing from the database are created first and the indexes
+    are created after all tables are rebuilt. Each table is rebuilt in its
+    own transaction. Returns the number of rows copied per table. Tables that
+    are already migrated are skipped, so this can be run again after an error.
+    """
+    models.create_tables('flask_blog.schema')
+    
+    migrated = dict()
+    for table in pending_timestamp_migrations():
+        column = TIMESTAMP_COLUMNS[table]
+        migrated[table] = models.rebuild_table(table, 'flask_blog.schema', { column: epoch_seconds })
+    
+    models.create_indexes('flask_blog.schema')
+    return migrated
+
+
+def sweep_table(
+    table_name: str,
+    key: str,
+    now: int,
+    batch_size: int = SWEEP_BATCH_SIZE,
+    pause: float = SWEEP_PAUSE
+    ) -> SweepResult:
+    """
+    Delete the rows of a table that expired before now (epoch seconds) in batches.
+
+    Each batch reads the keys of at most batch_size expired rows with
+    an index range scan on the expires column and deletes them.
+    The key must be a unique integer column, or 'rowid'.
+    """
+    table = getattr(models, table_name)
+    result = SweepResult(table_name)
+
+    while True:
+        start = time.perf_counter()
+        rows = table.query(columns = [key], limit = batch_size, expires__lt = now)
+        if not rows:
+            break
+
+        expired = [ getattr(row, key) for row in rows ]
+        with models.transaction():
+            table.delete(**{ f'{key}__in': expired })
+
+        result.removed += len(expired)
+        result.batch_times.append(time.perf_counter() - start)
+
+        if len(rows) < batch_size:
+            break
+        time.sleep(pause)
+
+    return result
+
+
+def sweep_expired(batch_size: int = SWEEP_BATCH_SIZE, pause: float = SWEEP_PAUSE) -> types.List[SweepResult]:
+    """
+    Delete the expired sessions, OTPs and session revocations.
+    Must be called inside an application context. Tables missing from
+    the database are skipped, see the 'create-tables' command.
+
+    Raises ValueError if the expiry times are still stored as text.
+    """
+    pending = [ table for table in pending_timestamp_migrations() if table in ('sessions', 'otps') ]
+    if pending:
+        raise ValueError(f'Run the migrate-timestamps command first, tables {", ".join(pending)} store text timestamps')
+
+    # The sessions and OTPs expire at minute precision, like Session.is_expired.
+    now = Timestamp()
+    sweeps = [
+        ('sessions', 'rowid', int(now)),
+        ('otps', 'id', int(now)),
+        ('session_revocations', 'rowid', int(time.time())),
+        ]
+    tables = models.list_tables()
+    return [ sweep_table(table, key, expires, batch_size, pause) for table, key, expires in sweeps if table in tables ]
+
+
+class Sweeper(threading.Thread):
+    """
+    Run sweep_expired every interval seconds until .stop() is called.
+    """
+
+    def __init__(self, app: flask.Flask, interval: float):
+        super().__init__(name='flask_blog.sweeper', daemon=True)
+        self.app = app
+        self.interval = interval
+        self.stopped = threading.Event()
+
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    results = sweep_expired(
+                        self.app.config.get('SWEEPER_BATCH_SIZE', SWEEP_BATCH_SIZE),
+                        self.app.config.get('SWEEPER_PAUSE', SWEEP_PAUSE)
+                        )
+                except Exception:
+                    self.app.logger.exception('Sweeping the expired rows failed')
+                else:
+                    for result in results:
+                        self.app.logger.info('Sweeper: %s', result)
+
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_sweeper(app: flask.Flask) -> types.Optional[Sweeper]:
+    """
+    Start the background sweeper if SWEEPER_INTERVAL is set.
+    """
+    interval = app.config.get('SWEEPER_INTERVAL', None)
+    if not interval:
+        return None
+
+    sweeper = Sweeper(app, interval)
+    sweeper.start()
+    app.extensions['sweeper'] = sweeper
+    return sweeper
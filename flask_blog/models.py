@@ -1,19 +1,121 @@
 import flask
 import sys
+import threading
 import flask_blog.typing as types
 import flask_blog.orm as orm
 
 
+connection_pools: types.Dict[types.Tuple[str, bool], orm.ConnectionPool] = dict()
+connection_pools_lock = threading.Lock()
+slow_query_logs: types.Dict[str, orm.SlowQueryLog] = dict()
+
+
+def get_pragmas() -> orm.Pragmas:
+    """
+    Build the pragmas applied to every new connection from
+    the DATABASE_PRAGMA_PROFILE and DATABASE_PRAGMAS settings.
+    """
+    config = flask.current_app.config
+    pragmas = orm.get_pragma_profile(config.get('DATABASE_PRAGMA_PROFILE', 'default'))
+    pragmas.update(config.get('DATABASE_PRAGMAS', {}))
+    return pragmas
+
+
+def get_connection_pool(database_path: str, readonly: bool = False) -> types.Optional[orm.ConnectionPool]:
+    """
+    Return the process-wide connection pool for the given database file.
+    The pool is created on first use. Returns None if pooling is disabled
+    (DATABASE_POOL_SIZE or DATABASE_READ_POOL_SIZE is 0).
+    """
+    config = flask.current_app.config
+    size_setting = 'DATABASE_READ_POOL_SIZE' if readonly else 'DATABASE_POOL_SIZE'
+    pool_size = config.get(size_setting, 0)
+    if not pool_size:
+        return None
+
+    key = (database_path, readonly)
+    with connection_pools_lock:
+        pool = connection_pools.get(key, None)
+        if pool is None:
+            pool = orm.ConnectionPool(
+                database_path,
+                pool_size,
+                config.get('DATABASE_POOL_TIMEOUT', None),
+                get_pragmas(),
+                readonly
+                )
+            connection_pools[key] = pool
+    return pool
+
+
 def create_and_store_database_object() -> types.DatabaseObject:
+    """
+    Create the database object for the current request.
+
+    With read routing enabled (DATABASE_READ_POOL_SIZE > 0), the writer
+    connection is only taken from the pool for the duration of a write
+    or a transaction, so read-only requests never hold it.
+
+    The table metadata is loaded once per process, see orm.SchemaCache.
+    """
     database = flask.g.get('database', None)
     if database is None:
         database_path = flask.current_app.config['DATABASE']
-        database = orm.Database(database_path)
-        database.store_connection()
+        read_pool = get_connection_pool(database_path, readonly=True)
+        database = orm.Database(
+            database_path,
+            get_connection_pool(database_path),
+            get_pragmas(),
+            read_pool,
+            orm.schema_cache
+            )
+        if read_pool is None:
+            database.store_connection()
+
+        if query_stats_enabled():
+            repeat_threshold = flask.current_app.config.get('DATABASE_QUERY_REPEAT_WARNING', 10)
+            collector = orm.QueryCollector(repeat_threshold)
+            database.observers.append(collector)
+            flask.g.query_collector = collector
+
+        slow_queries = get_slow_query_log()
+        if slow_queries is not None:
+            database.observers.append(slow_queries)
+        
         flask.g.database = database
     return database
 
 
+def query_stats_enabled() -> bool:
+    app = flask.current_app
+    enabled = app.config.get('DATABASE_QUERY_STATS', None)
+    return app.debug if enabled is None else bool(enabled)
+
+
+def get_slow_query_log() -> types.Optional[orm.SlowQueryLog]:
+    """
+    Return the process-wide slow query log configured with the SLOW_QUERY_LOG
+    and SLOW_QUERY_THRESHOLD settings, or None if the log is disabled.
+    """
+    config = flask.current_app.config
+    path = config.get('SLOW_QUERY_LOG', None)
+    if not path:
+        return None
+
+    with connection_pools_lock:
+        slow_queries = slow_query_logs.get(path, None)
+        if slow_queries is None:
+            slow_queries = orm.SlowQueryLog(
+                path,
+                config.get('SLOW_QUERY_THRESHOLD', 0.1),
+                config.get('SLOW_QUERY_LOG_MAX_BYTES', 1024 * 1024),
+                config.get('SLOW_QUERY_LOG_BACKUPS', 3)
+                )
+            slow_query_logs[path] = slow_queries
+    slow_queries.threshold = config.get('SLOW_QUERY_THRESHOLD', 0.1)
+    return slow_queries
+
+
 def get_database_table(table_name: str) -> types.DatabaseTable:
     database = create_and_store_database_object()
     return database.get_table(table_name)
@@ -25,6 +127,12 @@ class Module(types.Module):
     users = property(fget=lambda args: get_database_table('users'))
     otps = property(fget=lambda args: get_database_table('otps'))
     posts = property(fget=lambda args: get_database_table('posts'))
+    session_revocations = property(fget=lambda args: get_database_table('session_revocations'))
+
+
+    def transaction(self) -> types.ContextManager[types.DatabaseObject]:
+        database = create_and_store_database_object()
+        return database.transaction()
 
 
     def init_database(self, schema_module: str):
@@ -32,6 +140,65 @@ class Module(types.Module):
         database.init(schema_module)
 
 
+    def create_tables(self, schema_module: str) -> types.List[str]:
+        database = create_and_store_database_object()
+        return database.create_tables(schema_module)
+
+
+    def create_indexes(self, schema_module: str) -> types.Tuple[types.List[str], types.List[str]]:
+        database = create_and_store_database_object()
+        return database.create_indexes(schema_module)
+
+
+    def list_tables(self) -> types.List[str]:
+        database = create_and_store_database_object()
+        database.refresh_tables()
+        return list(database.tables.keys())
+
+
+    def table_schema(self, table_name: str) -> orm.TableSchema:
+        database = create_and_store_database_object()
+        # The table may have been rebuilt by another process.
+        database.refresh_tables()
+        return database.table_schema(table_name)
+
+
+    def rebuild_table(
+        self,
+        table_name: str,
+        schema_module: str,
+        convert: types.Dict[str, types.Callable[[types.Any], types.Any]]
+        ) -> int:
+        """
+        Recreate the table with its schema from the schema module.
+        The indexes of the table are dropped, see orm.Database.rebuild_table.
+        """
+        database = create_and_store_database_object()
+        schemas, _ = orm.load_schema(schema_module)
+        return database.rebuild_table(table_name, schemas[table_name], convert)
+
+
+    def report_queries(self, response: flask.Response) -> flask.Response:
+        """
+        Add the query statistics collected during the request into the response headers
+        and log a summary. Statements repeated more than DATABASE_QUERY_REPEAT_WARNING
+        times are logged as warnings, they usually mean a query is run inside a loop.
+        """
+        collector = flask.g.get('query_collector', None)
+        if collector is None:
+            return response
+
+        response.headers['X-Query-Count'] = str(len(collector.queries))
+        response.headers['X-Query-Time'] = f'{collector.total_time * 1000:.2f}ms'
+
+        logger = flask.current_app.logger
+        request = flask.request
+        logger.info('%s %s: %s', request.method, request.path, collector.summary())
+        for statement, count in collector.repeated():
+            logger.warning('%s %s: statement executed %d times: %s', request.method, request.path, count, statement)
+        return response
+
+
     def close_connection(self, *args, **kwargs):
         database = flask.g.pop('database', None)
         if database is not None:
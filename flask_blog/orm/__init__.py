@@ -11,15 +11,56 @@ import sqlite3
 import os
 import runpy
 import typing
+import contextlib
+import threading
+import keyword
+import itertools
+import collections
+import collections.abc
+import urllib.request
+import time
+import re
+import logging
+import logging.handlers
+import traceback
 
 import flask_blog.orm.sql as sql
 from flask_blog.common import Namespace
 
 
+Pragmas = typing.Dict[str, typing.Union[int, str]]
+
+# Pragmas that can't be applied to read-only connections.
+READ_WRITE_PRAGMAS = ('journal_mode',)
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+IN_LIST_PATTERN = re.compile(r'IN \((\?(, )?)*\)')
+
+INSERT_CHUNK_SIZE = 1000
+FETCH_BATCH_SIZE = 100
+
+# Named sets of PRAGMA statements applied to every new connection.
+PRAGMA_PROFILES: typing.Dict[str, Pragmas] = {
+    'default': {},
+    'performance': {
+        # Readers don't block the writer and vice versa.
+        'journal_mode': 'WAL',
+        # In WAL mode commits are durable after a checkpoint, not on every commit.
+        'synchronous': 'NORMAL',
+        # Negative values are in KiB: 16MB of page cache per connection.
+        'cache_size': -16000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+
+
 class Table:
     """
     Mapping a database table to an object.
-    A new connection is created with every method call.
+    A new connection is created with every method call,
+    unless the database has a stored connection or a connection pool.
     To reuse the connection between many queries,
     use the Table object as a context manager.
 
@@ -38,9 +79,16 @@ class Table:
 
         -> 1 connection, changes commited if no exceptions thrown.
 
-    All returned values are 'Namespace objects'.
-    They are thin wrappers on the builtin dict - object, so you can
-    access the columns with the dotted notation: value = row.column.
+    The keyword arguments of .get(), .query(), .delete() and .update()
+    can use lookups for other comparisons than equality:
+
+        database.sessions.delete(expires__lt = now)
+        database.users.query(id__in = [1, 2, 3])
+
+    See build_query for all supported lookups.
+
+    All returned values are 'Namespace objects' (see the Row class).
+    You can access the columns with the dotted notation: value = row.column.
     """
     
     def __init__(self, database, name: str):
@@ -50,20 +98,19 @@ class Table:
         self.logging = False
 
 
-    def get_all(self):
-        conn = self.database.conn
-        if conn is not None:
-            cursor = conn.cursor()
-            cursor.execute(sql.select(self.name))
-            return cursor.fetchall()
+    @property
+    def columns(self) -> typing.Dict[str, str]:
+        """
+        The column names of the table mapped to their declared types.
+        """
+        return self.database.table_schema(self.name).columns
 
-        with self.database.connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql.select(self.name))
-            return cursor.fetchall()
 
+    def get_all(self, columns: typing.Optional[typing.Sequence[str]] = None):
+        return self._read(sql.cached(sql.select, self.name, columns), (), fetch_all)
 
-    def get(self, **kwargs) -> Namespace:
+
+    def get(self, columns: typing.Optional[typing.Sequence[str]] = None, **kwargs) -> Namespace:
         """
         Perform SELECT - queries. Returns a single row or None if no results.
 
@@ -73,22 +120,75 @@ class Table:
         
         cursor.execute('SELECT * FROM table WHERE name = ?, hobby = ?', ('Dave', 'reading'))
         return cursor.fetchone()
+
+        Use the columns param to select only some of the columns:
+
+        database.users.get(columns=['id', 'username'], id=1)
+
+        translates to:
+
+        cursor.execute('SELECT id, username FROM users WHERE id = ?', (1,))
+        return cursor.fetchone()
         """
-        query = { col: sql.EQ for col in kwargs.keys() }
-        
-        conn = self.database.conn
-        if conn is not None:
-            cursor = conn.cursor()
-            cursor.execute(sql.select(self.name, None, **query), tuple(kwargs.values()))
-            return cursor.fetchone()
+        query, params = build_query(kwargs)
+        return self._read(sql.cached(sql.select, self.name, columns, **query), params, fetch_one)
+
+
+    def get_with(
+        self,
+        other: 'Table',
+        on: typing.Tuple[str, str],
+        columns: typing.Optional[typing.Sequence[str]] = None,
+        other_columns: typing.Optional[typing.Sequence[str]] = None,
+        **kwargs
+        ) -> typing.Optional[typing.Tuple[Namespace, typing.Optional[Namespace]]]:
+        """
+        Perform a SELECT - query for a single row and the matching row of another table.
+        Returns (row, other_row), other_row is None if there's no match.
+        Returns None if no results.
 
-        with self.database.connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql.select(self.name, None, **query), tuple(kwargs.values()))
-            return cursor.fetchone()
+        database.sessions.get_with(database.users, on=('user_id', 'id'), session_id=b'...')
 
+        translates to:
 
-    def query(self, **kwargs) -> typing.List[Namespace]:
+        cursor.execute(
+            'SELECT sessions.session_id, ..., users.id, ... FROM sessions
+             LEFT JOIN users ON sessions.user_id = users.id WHERE sessions.session_id = ?',
+            (b'...',)
+            )
+        
+        The columns of both tables are selected by default, the column names
+        are read from the table metadata (see the columns property).
+        """
+        selected = tuple(columns or self.columns)
+        other_selected = tuple(other_columns or other.columns)
+        query, params = build_query(kwargs)
+        statement = sql.cached(sql.select_join, self.name, list(selected), other.name, list(other_selected), tuple(on), **query)
+
+        def fetch(cursor: sqlite3.Cursor) -> typing.Optional[typing.Tuple[Namespace, typing.Optional[Namespace]]]:
+            cursor.row_factory = None
+            values = cursor.fetchone()
+            if values is None:
+                return None
+
+            row = make_row(selected, values[:len(selected)])
+            other_values = values[len(selected):]
+            if all(value is None for value in other_values):
+                return row, None
+            return row, make_row(other_selected, other_values)
+
+        return self._read(statement, params, fetch)
+
+
+    def query(
+        self,
+        order_by: typing.Union[str, typing.Sequence[str], None] = None,
+        after: typing.Any = None,
+        limit: typing.Optional[int] = None,
+        offset: typing.Optional[int] = None,
+        columns: typing.Optional[typing.Sequence[str]] = None,
+        **kwargs
+        ) -> typing.List[Namespace]:
         """
         Perform SELECT - queries. Returns a list of results.
         Use the .get_all() - method to retieve all rows from a table.
@@ -99,19 +199,168 @@ class Table:
         
         cursor.execute('SELECT * FROM table WHERE hobby = ?', ('reading',))
         return cursor.fetchall()
+
+        The results can be ordered and paginated:
+
+        database.posts.query(author_id=1, order_by='-id', after=100, limit=20)
+
+        translates to:
+
+        cursor.execute(
+            'SELECT * FROM posts WHERE author_id = ? AND id < ? ORDER BY id DESC LIMIT ?',
+            (1, 100, 20)
+            )
+        return cursor.fetchall()
+
+        The order_by param is a column name or a list of column names,
+        prefix the name with '-' for descending order. The after param is
+        a keyset cursor: only rows that come after this value of the
+        ordering column are returned. Use it instead of offset with
+        a unique column, so every page costs the same. With many ordering
+        columns (all in the same direction), after is a tuple of their values:
+
+        database.posts.query(order_by=['created', 'id'], after=(created, 100))
+
+        The columns param selects only the given columns, like in .get().
+        """
+        statement, params = self._select(order_by, after, limit, offset, columns, kwargs)
+        return self._read(statement, params, fetch_all)
+
+
+    def iter_all(
+        self,
+        batch_size: int = FETCH_BATCH_SIZE,
+        columns: typing.Optional[typing.Sequence[str]] = None
+        ) -> typing.Iterator[Namespace]:
+        """
+        Like .get_all(), but returns a generator that fetches
+        the rows from the database in batches of batch_size rows.
+        """
+        return self._iterate(sql.cached(sql.select, self.name, columns), (), batch_size)
+
+
+    def iter_query(
+        self,
+        batch_size: int = FETCH_BATCH_SIZE,
+        order_by: typing.Union[str, typing.Sequence[str], None] = None,
+        after: typing.Any = None,
+        limit: typing.Optional[int] = None,
+        offset: typing.Optional[int] = None,
+        columns: typing.Optional[typing.Sequence[str]] = None,
+        **kwargs
+        ) -> typing.Iterator[Namespace]:
+        """
+        Like .query(), but returns a generator that fetches
+        the rows from the database in batches of batch_size rows.
+
+        for user in database.users.iter_query(is_verified=1):
+            ...
+        
+        translates to:
+        
+        cursor.execute('SELECT * FROM users WHERE is_verified = ?', (1,))
+        rows = cursor.fetchmany(batch_size)
+        ...
+
+        The connection is held until the generator is exhausted or closed.
+        """
+        statement, params = self._select(order_by, after, limit, offset, columns, kwargs)
+        return self._iterate(statement, params, batch_size)
+
+
+    def _select(
+        self,
+        order_by: typing.Union[str, typing.Sequence[str], None],
+        after: typing.Any,
+        limit: typing.Optional[int],
+        offset: typing.Optional[int],
+        columns: typing.Optional[typing.Sequence[str]],
+        kwargs: typing.Dict[str, typing.Any]
+        ) -> typing.Tuple[str, typing.Tuple[typing.Any, ...]]:
+        """
+        Generate the statement and parameters for .query() and .iter_query().
         """
-        query = { col: sql.EQ for col in kwargs.keys() }
+        if isinstance(order_by, str):
+            order_by = (order_by,)
+
+        query, params = build_query(kwargs)
+        statement = sql.cached(sql.select, self.name, columns,
+            order_by = order_by,
+            after = after is not None,
+            limit = limit is not None,
+            offset = offset is not None,
+            **query
+            )
+        
+        if after is not None and order_by is not None and len(order_by) > 1:
+            if len(after) != len(order_by):
+                raise ValueError('The after param requires a value for each ordering column')
+            params += tuple(after)
+        elif after is not None:
+            params += (after,)
         
-        conn = self.database.conn
-        if conn is not None:
+        params += tuple(value for value in (limit, offset) if value is not None)
+        return statement, params
+
+
+    def _iterate(self, statement: str, params: typing.Tuple[typing.Any, ...], batch_size: int) -> typing.Iterator[Namespace]:
+        if batch_size < 1:
+            raise ValueError('Batch size must be atleast 1')
+        return self._fetch_in_batches(statement, params, batch_size)
+
+
+    def _fetch_in_batches(self, statement: str, params: typing.Tuple[typing.Any, ...], batch_size: int) -> typing.Iterator[Namespace]:
+        with self.database.connection(readonly=True) as conn:
+            start = time.perf_counter()
             cursor = conn.cursor()
-            cursor.execute(sql.select(self.name, None, **query), tuple(kwargs.values()))
-            return cursor.fetchall()
+            cursor.execute(statement, params)
+            duration = time.perf_counter() - start
+            row_count = 0
+            try:
+                while True:
+                    start = time.perf_counter()
+                    rows = cursor.fetchmany(batch_size)
+                    duration += time.perf_counter() - start
+                    if not rows:
+                        return
+                    row_count += len(rows)
+                    yield from rows
+            finally:
+                cursor.close()
+                self.database.notify(conn, statement, params, row_count, duration)
+
 
-        with self.database.connect() as conn:
+    def _read(self, statement: str, params: typing.Sequence[typing.Any], fetch: typing.Callable[[sqlite3.Cursor], typing.Any]) -> typing.Any:
+        """
+        Execute a SELECT - statement with a reader connection
+        and return the results fetched with fetch(cursor).
+        """
+        with self.database.connection(readonly=True) as conn:
+            start = time.perf_counter()
+            cursor = conn.cursor()
+            cursor.execute(statement, params)
+            result = fetch(cursor)
+            duration = time.perf_counter() - start
+            
+            row_count = len(result) if isinstance(result, list) else int(result is not None)
+            self.database.notify(conn, statement, params, row_count, duration)
+            return result
+
+
+    def _write(self, statement: str, params: typing.Sequence[typing.Any]) -> int:
+        """
+        Execute a statement with the writer connection and commit the changes,
+        unless inside a transaction. Returns the number of modified rows.
+        """
+        with self.database.connection() as conn:
+            start = time.perf_counter()
             cursor = conn.cursor()
-            cursor.execute(sql.select(self.name, None, **query), tuple(kwargs.values()))
-            return cursor.fetchall()
+            cursor.execute(statement, params)
+            self.database.commit(conn)
+            duration = time.perf_counter() - start
+            
+            self.database.notify(conn, statement, params, cursor.rowcount, duration)
+            return cursor.rowcount
 
 
     def delete(self, **kwargs):
@@ -127,19 +376,8 @@ class Table:
 
         If no argmuents are provided all rows are deleted.
         """
-        query = { col: sql.EQ for col in kwargs.keys() }
-        
-        conn = self.database.conn
-        if conn is not None:
-            cursor = conn.cursor()
-            cursor.execute(sql.delete(self.name, **query), tuple(kwargs.values()))
-            conn.commit()
-            return
-
-        with self.database.connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql.delete(self.name, **query), tuple(kwargs.values()))
-            conn.commit()
+        query, params = build_query(kwargs)
+        self._write(sql.cached(sql.delete, self.name, **query), params)
 
 
     def update(self, **kwargs) -> typing.ContextManager:
@@ -164,24 +402,59 @@ class Table:
         Commit updates made within the context manager.
         Use the context manager api instead of this.
         """
-        query = { col: sql.EQ for col in restrictions.keys() }
+        query, query_params = build_query(restrictions)
         columns = list(changes.keys())
-        params = tuple(list(changes.values()) + list(restrictions.values()))
+        params = tuple(changes.values()) + query_params
+        self._write(sql.cached(sql.update, self.name, columns, **query), params)
 
-        conn = self.database.conn
-        if conn is not None:
-            cursor = conn.cursor()
-            cursor.execute(sql.update(self.name, columns, **query), params)
-            conn.commit()
-            return
+
+    def update_many(self, changes_by_key: typing.Mapping[typing.Any, typing.Mapping[str, typing.Any]], key: str = 'id') -> int:
+        """
+        Perform UPDATE - actions with different changes for many rows.
+
+        database.users.update_many({
+            1: {'login_attempts': 0},
+            2: {'login_attempts': 0, 'is_locked': 0},
+            3: {'login_attempts': 0, 'is_locked': 0},
+            })
         
-        with self.database.connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql.update(self.name, columns, **query), params)
-            conn.commit()
+        translates to:
+        
+        cursor.executemany('UPDATE users SET login_attempts = ? WHERE id = ?', [(0, 1)])
+        cursor.executemany(
+            'UPDATE users SET is_locked = ?, login_attempts = ? WHERE id = ?',
+            [(0, 0, 2), (0, 0, 3)]
+            )
 
+        The rows are identified by the key column. Rows with the same set of changed
+        columns are updated with a single executemany - call and all changes
+        are commited once. Returns the number of updated rows.
+        """
+        groups: typing.Dict[typing.Tuple[str, ...], typing.List[typing.Tuple[typing.Any, ...]]] = collections.defaultdict(list)
+        for key_value, changes in changes_by_key.items():
+            if not changes:
+                continue
+            columns = tuple(sorted(changes.keys()))
+            groups[columns].append(tuple(changes[col] for col in columns) + (key_value,))
+        
+        if not groups:
+            return 0
+
+        count = 0
+        with self.database.transaction() as database:
+            for columns, params in groups.items():
+                statement = sql.cached(sql.update, self.name, list(columns), **{ key: sql.EQ })
+                start = time.perf_counter()
+                cursor = database.conn.cursor()
+                cursor.executemany(statement, params)
+                duration = time.perf_counter() - start
+                database.notify(database.conn, statement, params, cursor.rowcount, duration, many=True)
+                count += cursor.rowcount
+        
+        return count
 
-    def insert(self, **kwargs):
+
+    def insert(self, or_ignore: bool = False, **kwargs) -> bool:
         """
         Perform INSERT - actions.
 
@@ -197,31 +470,182 @@ class Table:
             'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
             ('foobar1', 'spam@mail.com', b'some bytes')
             )
+
+        With or_ignore = True the statement is INSERT OR IGNORE, and a row violating
+        a constraint is skipped instead of raising an error.
+        Returns True if the row was inserted.
         """
-        conn = self.database.conn
-        if conn is not None:
-            cursor = conn.cursor()
-            cursor.execute(sql.insert(self.name, kwargs.keys()), tuple(kwargs.values()))
-            conn.commit()
-            return
+        statement = sql.cached(sql.insert, self.name, list(kwargs.keys()), or_ignore=or_ignore)
+        return self._write(statement, tuple(kwargs.values())) > 0
+
+
+    def upsert(self, conflict: typing.Union[str, typing.Sequence[str], None], on_conflict: str = 'ignore', **kwargs) -> bool:
+        """
+        Perform INSERT - actions, which handle uniqueness conflicts in the database.
+
+        database.sessions.upsert('session_id', session_id = b'...', user_id = 1)
         
-        with self.database.connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql.insert(self.name, kwargs.keys()), tuple(kwargs.values()))
-            conn.commit()
+        translates to:
+        
+        cursor.execute(
+            'INSERT INTO sessions (session_id, user_id) VALUES (?, ?) ON CONFLICT (session_id) DO NOTHING',
+            (b'...', 1)
+            )
+
+        The conflict columns must have a unique constraint or a unique index.
+        With on_conflict = 'update' the existing row is updated with the other values:
+
+        ... ON CONFLICT (session_id) DO UPDATE SET user_id = excluded.user_id
+
+        With conflict = None, a conflict with any unique constraint is ignored:
+
+        ... ON CONFLICT DO NOTHING
+
+        Unlike insert(or_ignore = True), other constraint violations raise an error.
+
+        Returns True if a row was inserted or updated.
+        """
+        if on_conflict not in ('ignore', 'update'):
+            raise ValueError(f'Invalid on_conflict value: {repr(on_conflict)}')
+
+        targets = (conflict,) if isinstance(conflict, str) else tuple(conflict) if conflict is not None else None
+        columns = list(kwargs.keys())
+        update = [ col for col in columns if col not in (targets or ()) ] if on_conflict == 'update' else None
+        statement = sql.cached(sql.upsert, self.name, columns, targets, update=update)
+        return self._write(statement, tuple(kwargs.values())) > 0
+
+
+    def insert_many(
+        self,
+        rows: typing.Iterable[typing.Union[typing.Mapping[str, typing.Any], typing.Sequence[typing.Any]]],
+        columns: typing.Optional[typing.Sequence[str]] = None,
+        chunk_size: int = INSERT_CHUNK_SIZE
+        ) -> int:
+        """
+        Perform INSERT - actions for many rows at once.
+
+        database.users.insert_many([
+            {'username': 'foobar1', 'email': 'spam@mail.com'},
+            {'username': 'foobar2', 'email': 'eggs@mail.com'},
+            ])
+
+        database.users.insert_many(
+            [('foobar1', 'spam@mail.com'), ('foobar2', 'eggs@mail.com')],
+            columns = ('username', 'email')
+            )
+        
+        translates to:
+        
+        cursor.executemany(
+            'INSERT INTO users (username, email) VALUES (?, ?)',
+            [('foobar1', 'spam@mail.com'), ('foobar2', 'eggs@mail.com')]
+            )
+
+        Rows can be mappings or sequences. For mappings the columns are taken
+        from the first row and all rows must have the same keys, for sequences
+        the columns must be provided.
+
+        The rows are inserted in chunks of chunk_size rows and changes are commited
+        once per chunk. If a chunk fails, it is rolled back and the error is raised,
+        previous chunks stay commited. Inside a transaction, the chunks are
+        commited with the transaction. Returns the number of inserted rows.
+        """
+        if chunk_size < 1:
+            raise ValueError('Chunk size must be atleast 1')
+
+        iterator = iter(rows)
+        first = next(iterator, None)
+        if first is None:
+            return 0
+
+        row_values: typing.Callable[[typing.Any], typing.Tuple[typing.Any, ...]]
+        if isinstance(first, collections.abc.Mapping):
+            if columns is None:
+                columns = tuple(first.keys())
+            
+            column_set = set(columns)
+            def row_values(row):
+                if row.keys() != column_set:
+                    raise ValueError('All rows must have the same columns')
+                return tuple(row[col] for col in columns)
+        
+        else:
+            if columns is None:
+                raise ValueError('Columns must be provided when inserting sequences')
+            row_values = tuple
+
+        statement = sql.cached(sql.insert, self.name, list(columns))
+        iterator = itertools.chain((first,), iterator)
+        count = 0
+        
+        stored = self.database.conn is not None
+        self.database.store_connection()
+        try:
+            while True:
+                chunk = [ row_values(row) for row in itertools.islice(iterator, chunk_size) ]
+                if not chunk:
+                    break
+
+                with self.database.transaction() as database:
+                    start = time.perf_counter()
+                    cursor = database.conn.cursor()
+                    cursor.executemany(statement, chunk)
+                    duration = time.perf_counter() - start
+                    database.notify(database.conn, statement, chunk, len(chunk), duration, many=True)
+                count += len(chunk)
+        
+        finally:
+            if not stored:
+                self.database.release_connection()
+        
+        return count
 
 
 class Database:
 
-    def __init__(self, path: str):
+    """
+    A single SQLite database file.
+
+    Connections are opened per call, stored with .store_connection()
+    or drawn from a connection pool. If a read_pool of read-only
+    connections is given, the reading Table methods (.get(), .query(),
+    .get_all()...) use a separate reader connection and only the writes
+    use the writer connection. Inside a transaction, or when the
+    read_your_writes attribute is set, the reads also go to the writer.
+
+    If a schema_cache is given, the table metadata is shared with
+    the other Database objects of the same file and only the
+    PRAGMA schema_version is queried when the object is created,
+    see the SchemaCache class.
+    """
+
+    def __init__(self,
+        path: str,
+        pool: typing.Optional['ConnectionPool'] = None,
+        pragmas: typing.Optional[Pragmas] = None,
+        read_pool: typing.Optional['ConnectionPool'] = None,
+        schema_cache: typing.Optional['SchemaCache'] = None
+        ):
         self.path = path
+        self.pool = pool
+        self.pragmas = pragmas
+        self.read_pool = read_pool
+        self.read_your_writes = False
+        self.observers: typing.List[QueryObserver] = list()
         self.conn: typing.Optional[sqlite3.Connection] = None
-        self.tables = { name: Table(self, name) for name in self.list_tables() }
+        self.reader: typing.Optional[sqlite3.Connection] = None
+        self.transaction_depth = 0
+        self.schema_cache = schema_cache
+        self.database_file_exists = False
+        self.schema_version_checked = False
+        
+        table_names = self.schema_cache.get(self).keys() if self.schema_cache else self.list_tables()
+        self.tables = { name: Table(self, name) for name in table_names }
 
 
     def init(self, schema_module: str):
         """
-        Create tables specified inside .py - file.
+        Create tables and indexes specified inside .py - file.
         The schema_module param must be string in form of 'pkg.module'.
 
         Like in the .create_table - method, the schema must be a dictionary in the form of:
@@ -231,36 +655,208 @@ class Database:
             'column_name': sql.datatype(**kwargs),
             ...
             }
+
+        Indexes are declared with the sql.datatypes.index - function:
+
+        index_name = index('table_name', 'column_name', ...)
         """
-        module_namespace = runpy.run_module(schema_module)
-        schemas = dict()
-        
-        for key, value in module_namespace.items():
-            if key not in vars(sql.datatypes) and not key.startswith('_'):
-                schemas[key] = value
+        schemas, indexes = load_schema(schema_module)
                 
         if self.conn:
             for name, schema in schemas.items():
                 self.create_table(name, schema)
+            for name, index in indexes.items():
+                self.create_index(name, index)
         
         else:
             try:
-                self.conn = self.connect()
+                self.store_connection()
                 for name, schema in schemas.items():
                     self.create_table(name, schema)
+                for name, index in indexes.items():
+                    self.create_index(name, index)
             finally:
-                self.close_connection()
+                self.release_connection()
+
+
+    def create_tables(self, schema_module: str) -> typing.List[str]:
+        """
+        Create the tables specified inside .py - file that don't exist yet.
+        Use this to add new tables to an existing database, the existing
+        tables are not changed. Returns the names of the created tables.
+        """
+        schemas, _ = load_schema(schema_module)
+        self.refresh_tables()
+        created = list()
+
+        for name, schema in schemas.items():
+            if name not in self.tables:
+                self.create_table(name, schema)
+                created.append(name)
+        return created
+
+
+    def create_indexes(self, schema_module: str) -> typing.Tuple[typing.List[str], typing.List[str]]:
+        """
+        Create the indexes specified inside .py - file that don't exist yet.
+        Use this to add new indexes to an existing database. The indexes
+        of tables missing from the database are skipped, see .create_tables().
+        Returns the names of the created and the skipped indexes.
+        """
+        _, indexes = load_schema(schema_module)
+        existing = self.list_indexes()
+        tables = self.list_tables()
+        created = list()
+        skipped = list()
+        
+        for name, index in indexes.items():
+            if name in existing:
+                continue
+            if index.table not in tables:
+                skipped.append(name)
+                continue
+            self.create_index(name, index)
+            created.append(name)
+        return created, skipped
 
     
     def store_connection(self):
+        """
+        Keep a connection open until .close_connection() or .release_connection() is called.
+        If the database has a connection pool, the connection is taken from it.
+        """
         if self.conn is None:
-            self.conn = self.connect()
+            self.conn = self.pool.acquire() if self.pool else self.connect()
 
 
     def connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.path)
-        conn.row_factory = row_factory
-        return conn
+        return create_connection(self.path, pragmas=self.pragmas)
+
+
+    def file_exists(self) -> bool:
+        """
+        The read-only connections can't create the database file,
+        so reads go through the writer until the file exists.
+        """
+        if not self.database_file_exists:
+            self.database_file_exists = os.path.exists(self.path)
+        return self.database_file_exists
+
+
+    @contextlib.contextmanager
+    def connection(self, readonly: bool = False) -> typing.Iterator[sqlite3.Connection]:
+        """
+        Yield the stored connection if there is one.
+        Otherwise a temporary connection is opened (or taken from the pool)
+        and closed (or returned to the pool) when the block exits.
+
+        If readonly is True and the database has a read pool, the reader
+        connection is yielded instead. It is kept until .close_connection().
+        Until the database file exists, the reads use the writer connection.
+        """
+        if readonly and self.read_pool and not (self.transaction_depth or self.read_your_writes) and self.file_exists():
+            if self.reader is None:
+                self.reader = self.read_pool.acquire()
+            yield self.reader
+            return
+        
+        if self.conn is not None:
+            yield self.conn
+            return
+
+        conn = self.pool.acquire() if self.pool else self.connect()
+        try:
+            yield conn
+        finally:
+            if self.pool:
+                self.pool.release(conn)
+            else:
+                conn.close()
+
+
+    @contextlib.contextmanager
+    def transaction(self) -> typing.Iterator['Database']:
+        """
+        Group many statements into a single transaction:
+
+        with database.transaction():
+            database.otps.delete(user_id = 1)
+            database.users.delete(id = 1)
+
+        -> 1 commit, changes are rolled back if an exception is raised.
+
+        The per-statement commits made by the Table methods are suppressed
+        inside the block. Transactions can be nested, the inner blocks
+        are implemented with savepoints and rolled back on their own.
+
+        A connection is stored for the duration of the outermost block
+        if the database doesn't have one already.
+        """
+        stored = self.conn is not None
+        self.store_connection()
+        conn = typing.cast(sqlite3.Connection, self.conn)
+        
+        depth = self.transaction_depth
+        savepoint = f'transaction{depth}'
+        conn.execute(f'SAVEPOINT {savepoint}' if depth else 'BEGIN')
+        self.transaction_depth += 1
+        
+        try:
+            yield self
+        
+        except BaseException:
+            self.transaction_depth -= 1
+            if depth:
+                conn.execute(f'ROLLBACK TO {savepoint}')
+                conn.execute(f'RELEASE {savepoint}')
+            else:
+                conn.rollback()
+            raise
+        
+        else:
+            self.transaction_depth -= 1
+            if depth:
+                conn.execute(f'RELEASE {savepoint}')
+            else:
+                conn.commit()
+        
+        finally:
+            if not stored and not depth:
+                self.release_connection()
+
+
+    def notify(self,
+        conn: sqlite3.Connection,
+        statement: str,
+        params: typing.Sequence[typing.Any],
+        row_count: int,
+        duration: float,
+        many: bool = False
+        ):
+        """
+        Pass a statement executed by a Table to all observers.
+        Observers are callables added to the .observers list, see QueryCollector.
+
+        The params are the parameters of the statement. If many is True,
+        the statement was executed with cursor.executemany and
+        the params are a list of parameter tuples.
+        """
+        for observer in self.observers:
+            observer(conn, statement, params, row_count, duration, many)
+
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.transaction_depth > 0
+
+
+    def commit(self, conn: sqlite3.Connection):
+        """
+        Commit the changes made with the given connection,
+        unless they are part of a transaction.
+        """
+        if not self.transaction_depth:
+            conn.commit()
 
 
     def create_table(self, name: str, schema: typing.Dict[str, sql.DataType]) -> Table:
@@ -283,34 +879,44 @@ class Database:
         if not sql.valid_schema(schema):
             raise ValueError('Invalid schema')
 
-        if self.conn:
-            cursor = self.conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute(sql.create_table(name, **schema))
-            self.conn.commit()
-        
-        else:
-            with self.connect() as conn:
-                cursor = conn.cursor()
-                cursor.execute(sql.create_table(name, **schema))
-                conn.commit()
+            self.commit(conn)
         
+        self.schema_changed()
         table = Table(self, name)
         self.tables[name] = table
         return table
 
 
+    def create_index(self, name: str, index: sql.Index):
+        """
+        Create a new index, if an index with the same name doesn't exist.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql.create_index(name, index))
+            self.commit(conn)
+
+        self.schema_changed()
+
+
+    def list_indexes(self) -> typing.List[str]:
+        with self.connection(readonly=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql.list_indexes())
+            indexes = cursor.fetchall()
+        
+        return [ row.name for row in indexes ]
+
+
     def list_tables(self) -> typing.List[str]:
-        if self.conn:
-            cursor = self.conn.cursor()
+        with self.connection(readonly=True) as conn:
+            cursor = conn.cursor()
             cursor.execute(sql.list_tables())
             tables = cursor.fetchall()
         
-        else:
-            with self.connect() as conn:
-                cursor = conn.cursor()
-                cursor.execute(sql.list_tables())
-                tables = cursor.fetchall()
-        
         return [ row.name for row in tables ]
 
 
@@ -320,31 +926,507 @@ class Database:
 
         self.tables.pop(name)
 
-        if self.conn:
-            cursor = self.conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute(sql.drop_table(name))
-            self.conn.commit()
-            return
+            self.commit(conn)
+
+        self.schema_changed()
+
+
+    def rebuild_table(
+        self,
+        name: str,
+        schema: typing.Dict[str, sql.DataType],
+        convert: typing.Optional[typing.Dict[str, typing.Callable[[typing.Any], typing.Any]]] = None,
+        chunk_size: int = INSERT_CHUNK_SIZE
+        ) -> int:
+        """
+        Recreate a table with a new schema and copy the rows into it.
+        SQLite can't change the type of a column with ALTER TABLE,
+        so this is the way to migrate existing columns:
+
+        database.rebuild_table('posts', schema, convert = {'created': parse_timestamp})
+
+        translates to:
+
+        CREATE TABLE posts_rebuild (...)
+        SELECT id, created, ... FROM posts  -> converted and inserted into posts_rebuild
+        DROP TABLE posts
+        ALTER TABLE posts_rebuild RENAME TO posts
+
+        The convert param maps column names to functions called with the old values.
+        Columns missing from the old table get their default values. Everything
+        is done in one transaction. The indexes of the table are dropped with it,
+        recreate them with .create_indexes(). Returns the number of copied rows.
+        """
+        if name not in self.tables:
+            raise ValueError(f'No such table: "{name}"')
+
+        if not sql.valid_schema(schema):
+            raise ValueError('Invalid schema')
+
+        convert = convert or dict()
+        temporary = f'{name}_rebuild'
+        copied = 0
+
+        with self.transaction():
+            conn = typing.cast(sqlite3.Connection, self.conn)
+            old_columns = self.table_schema(name).columns
+            columns = [ col for col in schema if col in old_columns ]
+            converters = [ convert.get(col, None) for col in columns ]
 
-        with self.connect() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(sql.create_table(temporary, **schema))
+            
+            reader = conn.cursor()
+            reader.row_factory = None
+            reader.execute(sql.select(name, columns))
+            insert = sql.insert(temporary, columns)
+            while True:
+                rows = reader.fetchmany(chunk_size)
+                if not rows:
+                    break
+                values = [
+                    tuple(value if function is None else function(value) for function, value in zip(converters, row))
+                    for row in rows
+                    ]
+                cursor.executemany(insert, values)
+                copied += len(values)
+            
+            reader.close()
             cursor.execute(sql.drop_table(name))
-            conn.commit()
-        
+            cursor.execute(sql.rename_table(temporary, name))
+            cursor.close()
+
+        self.schema_changed()
+        self.tables[name] = Table(self, name)
+        return copied
+
 
     def close_connection(self, *args, **kwargs):
+        """
+        Close the stored connections, or return them to the pools
+        if the database has them.
+        """
+        if self.reader:
+            self.read_pool.release(self.reader)
+            self.reader = None
+        
+        self.release_connection()
+
+
+    def release_connection(self):
+        """
+        Close the stored writer connection, or return it to the pool.
+        The reader connection is kept, it may still be used by an open cursor.
+        """
         if self.conn:
-            self.conn.close()
+            if self.pool:
+                self.pool.release(self.conn)
+            else:
+                self.conn.close()
             self.conn = None
 
 
+    def table_schema(self, name: str) -> 'TableSchema':
+        """
+        Return the columns and indexes of a table.
+        """
+        if self.schema_cache:
+            schema = self.schema_cache.get(self).get(name, None)
+            if schema is None:
+                schema = self.schema_cache.refresh(self).get(name, None)
+        else:
+            with self.connection(readonly=True) as conn:
+                schema = load_schema_metadata(conn).get(name, None)
+        
+        if schema is None:
+            raise AttributeError('No such table')
+        return schema
+
+
+    def refresh_tables(self):
+        """
+        Update the tables to match the database file.
+        With a schema cache this only queries the PRAGMA schema_version,
+        unless the schema has been changed.
+        """
+        table_names = self.schema_cache.refresh(self).keys() if self.schema_cache else self.list_tables()
+        self.tables = { name: self.tables.get(name, None) or Table(self, name) for name in table_names }
+
+
+    def schema_changed(self):
+        if self.schema_cache:
+            self.schema_cache.invalidate(self.path)
+
+
     def get_table(self, name: str) -> Table:
         table = self.tables.get(name, None)
+        if table is None and self.schema_cache:
+            # Created by another connection after the metadata was cached.
+            self.refresh_tables()
+            table = self.tables.get(name, None)
+        
         if table is None:
             raise AttributeError('No such table')
         return table
 
 
+class TableSchema(typing.NamedTuple):
+    columns: typing.Dict[str, str]
+    indexes: typing.Tuple[str, ...]
+
+
+class SchemaCache:
+    """
+    Table metadata shared by all Database objects of the same file.
+
+    The metadata is loaded once and kept until the schema is changed
+    with the Database methods, or until the PRAGMA schema_version of
+    the file changes. The version is checked once per Database object:
+
+    schema_cache = SchemaCache()
+    Database(path, schema_cache=schema_cache)   -> metadata loaded
+    Database(path, schema_cache=schema_cache)   -> PRAGMA schema_version only
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: typing.Dict[str, typing.Tuple[int, typing.Dict[str, TableSchema]]] = dict()
+        self.loads = 0
+
+
+    def get(self, database: Database) -> typing.Dict[str, TableSchema]:
+        """
+        Return the cached metadata. The schema_version is checked
+        the first time the metadata is requested by the database object.
+        """
+        with self.lock:
+            entry = self.entries.get(self.key(database.path), None)
+        
+        if entry is None or not database.schema_version_checked:
+            return self.refresh(database)
+        return entry[1]
+
+
+    def refresh(self, database: Database) -> typing.Dict[str, TableSchema]:
+        """
+        Reload the metadata if the schema_version of the file
+        doesn't match the cached version.
+        """
+        key = self.key(database.path)
+        with database.connection(readonly=True) as conn:
+            version = read_schema_version(conn)
+            database.schema_version_checked = True
+            with self.lock:
+                entry = self.entries.get(key, None)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+            
+            tables = load_schema_metadata(conn)
+
+        # Uncommitted schema changes could still be rolled back.
+        if not database.in_transaction and database.path != ':memory:':
+            with self.lock:
+                self.entries[key] = (version, tables)
+                self.loads += 1
+        return tables
+
+
+    def invalidate(self, path: str):
+        with self.lock:
+            self.entries.pop(self.key(path), None)
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+    @staticmethod
+    def key(path: str) -> str:
+        return os.path.abspath(path) if path != ':memory:' else path
+
+
+schema_cache = SchemaCache()
+
+
+def read_schema_version(conn: sqlite3.Connection) -> int:
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql.schema_version())
+    version = cursor.fetchone()[0]
+    cursor.close()
+    return version
+
+
+def load_schema_metadata(conn: sqlite3.Connection) -> typing.Dict[str, TableSchema]:
+    """
+    Read the columns and indexes of every table in the database.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql.list_schema())
+    objects = cursor.fetchall()
+
+    indexes: typing.Dict[str, typing.List[str]] = collections.defaultdict(list)
+    for object_type, name, table in objects:
+        if object_type == 'index':
+            indexes[table].append(name)
+    
+    tables = dict()
+    for object_type, name, _ in objects:
+        if object_type != 'table':
+            continue
+        cursor.execute(sql.table_info(name))
+        columns = { column[1]: column[2] for column in cursor.fetchall() }
+        tables[name] = TableSchema(columns, tuple(indexes[name]))
+    
+    cursor.close()
+    return tables
+
+
+QueryObserver = typing.Callable[[sqlite3.Connection, str, typing.Sequence[typing.Any], int, float, bool], None]
+
+
+class QueryCollector:
+    """
+    Collect statistics of the statements executed with a database, usually during one request:
+
+    collector = QueryCollector()
+    database.observers.append(collector)
+
+    The statement text, number of parameters, number of rows and the duration
+    (in seconds) are recorded for every statement into the .queries list.
+    The same statement executed more than repeat_threshold times (N+1 queries)
+    is reported by .repeated().
+    """
+
+    def __init__(self, repeat_threshold: int = 10):
+        self.repeat_threshold = repeat_threshold
+        self.queries: typing.List[typing.Tuple[str, int, int, float]] = list()
+        self.counts: typing.Counter[str] = collections.Counter()
+
+
+    def __call__(self,
+        conn: sqlite3.Connection,
+        statement: str,
+        params: typing.Sequence[typing.Any],
+        row_count: int,
+        duration: float,
+        many: bool = False
+        ):
+        param_count = sum(len(item) for item in params) if many else len(params)
+        self.queries.append((statement, param_count, row_count, duration))
+        self.counts[statement] += 1
+
+
+    @property
+    def total_time(self) -> float:
+        return sum(query[3] for query in self.queries)
+
+
+    def repeated(self) -> typing.List[typing.Tuple[str, int]]:
+        """
+        Return the statements executed more than repeat_threshold times
+        as (statement, count) - tuples.
+        """
+        return [ (statement, count) for statement, count in self.counts.items() if count > self.repeat_threshold ]
+
+
+    def summary(self) -> str:
+        rows = sum(query[2] for query in self.queries)
+        return f'{len(self.queries)} queries, {rows} rows, {self.total_time * 1000:.2f} ms'
+
+
+class SlowQueryLog:
+    """
+    Log the statements slower than threshold seconds into a rotating log file:
+
+    slow_queries = SlowQueryLog('slow-queries.log', threshold=0.05)
+    database.observers.append(slow_queries)
+
+    Every entry contains the duration, the normalized statement text, the call site
+    outside the ORM and the output of EXPLAIN QUERY PLAN for the statement.
+    """
+
+    def __init__(self, path: str, threshold: float = 0.1, max_bytes: int = 1024 * 1024, backup_count: int = 3):
+        self.path = path
+        self.threshold = threshold
+        self.handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.handler.setFormatter(logging.Formatter('[%(asctime)s] %(message)s'))
+        
+        # Not registered with logging.getLogger, so the entries are not propagated
+        # to the application logs and every log file gets its own logger.
+        self.logger = logging.Logger(f'{__name__}.slow_queries', logging.INFO)
+        self.logger.addHandler(self.handler)
+
+
+    def __call__(self,
+        conn: sqlite3.Connection,
+        statement: str,
+        params: typing.Sequence[typing.Any],
+        row_count: int,
+        duration: float,
+        many: bool = False
+        ):
+        if duration < self.threshold:
+            return
+
+        plan = explain_query_plan(conn, statement, params[0] if many and params else params)
+        lines = [
+            f'{duration * 1000:.2f} ms, {row_count} rows: {normalize_statement(statement)}',
+            f'  called from {find_call_site()}',
+            ]
+        lines.extend(f'  {line}' for line in plan)
+        self.logger.warning('\n'.join(lines))
+
+
+    def close(self):
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+
+def normalize_statement(statement: str) -> str:
+    """
+    Collapse whitespace and IN - lists of any length,
+    so the same kind of statements have the same text.
+    """
+    statement = WHITESPACE_PATTERN.sub(' ', statement.strip())
+    return IN_LIST_PATTERN.sub('IN (...)', statement)
+
+
+def explain_query_plan(conn: sqlite3.Connection, statement: str, params: typing.Sequence[typing.Any]) -> typing.List[str]:
+    """
+    Return the lines of EXPLAIN QUERY PLAN - output for the statement.
+    The statement is not executed.
+    """
+    try:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(f'EXPLAIN QUERY PLAN {statement}', params)
+        rows = cursor.fetchall()
+        cursor.close()
+    except sqlite3.Error as err:
+        return [f'QUERY PLAN unavailable: {err}']
+
+    depths: typing.Dict[int, int] = dict()
+    lines = ['QUERY PLAN']
+    for node_id, parent, _, detail in rows:
+        depth = depths.get(parent, 0) + 1
+        depths[node_id] = depth
+        lines.append('  ' * depth + str(detail))
+    return lines
+
+
+def find_call_site() -> str:
+    """
+    Return 'file:line in function' for the innermost frame outside this package.
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(package_dir) or filename == contextlib.__file__:
+            continue
+        return f'{frame.filename}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of connections to a single database file.
+
+    Connections are opened lazily up to max_size. When all connections
+    are in use, .acquire() blocks until one is released or the timeout
+    expires, in which case a TimeoutError is raised.
+
+    Connections returned to the pool are rolled back if they have an
+    uncommitted transaction, so the next user always gets a clean connection.
+    """
+
+    def __init__(self,
+        path: str,
+        max_size: int = 8,
+        timeout: typing.Optional[float] = None,
+        pragmas: typing.Optional[Pragmas] = None,
+        readonly: bool = False
+        ):
+        if max_size < 1:
+            raise ValueError('Pool size must be atleast 1')
+
+        self.path = path
+        self.pragmas = pragmas
+        self.readonly = readonly
+        self.max_size = max_size
+        self.timeout = timeout
+        self.size = 0
+        self.idle: typing.List[sqlite3.Connection] = list()
+        self.closed = False
+        self.condition = threading.Condition()
+
+
+    def acquire(self) -> sqlite3.Connection:
+        with self.condition:
+            if self.closed:
+                raise ValueError('Connection pool is closed')
+
+            if not self.idle and self.size >= self.max_size:
+                available = lambda: self.idle or self.size < self.max_size
+                if not self.condition.wait_for(available, self.timeout):
+                    raise TimeoutError('Timed out waiting for a database connection')
+
+            if self.idle:
+                return self.idle.pop()
+            
+            self.size += 1
+
+        try:
+            return create_connection(self.path,
+                pragmas = self.pragmas,
+                readonly = self.readonly,
+                check_same_thread = False
+                )
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+
+
+    def release(self, conn: sqlite3.Connection):
+        broken = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            broken = True
+
+        with self.condition:
+            if broken or self.closed:
+                self.size -= 1
+                if not broken:
+                    conn.close()
+            else:
+                self.idle.append(conn)
+            self.condition.notify()
+
+
+    def close(self):
+        """
+        Close all idle connections. Connections currently in use
+        are closed when they are released.
+        """
+        with self.condition:
+            self.closed = True
+            while self.idle:
+                self.idle.pop().close()
+                self.size -= 1
+            self.condition.notify_all()
+
+
 class Transaction:
     def __init__(self, table, query):
         object.__setattr__(self, 'table', table)
@@ -369,9 +1451,227 @@ class Transaction:
             table._make_updates(query, changes)
 
 
+LOOKUPS = {
+    'eq': sql.EQ,
+    'ne': sql.NE,
+    'lt': sql.LT,
+    'le': sql.LE,
+    'gt': sql.GT,
+    'ge': sql.GE,
+    'like': sql.LIKE,
+    'in': sql.IN,
+    'between': sql.BETWEEN,
+    'isnull': sql.IS_NULL,
+    }
+
+
+def build_query(kwargs: typing.Dict[str, typing.Any]) -> typing.Tuple[typing.Dict[str, sql.Operator], typing.Tuple[typing.Any, ...]]:
+    """
+    Translate keyword arguments into a query for the orm.sql module and its parameters.
+
+    A keyword is a column name, optionally followed by a lookup separated with '__':
+
+        id = 1                      -> id = ?
+        id__ne = 1                  -> id != ?
+        expires__lt = 100           -> expires < ?          (also __le, __gt, __ge)
+        username__like = 'foo%'     -> username LIKE ?
+        id__in = [1, 2, 3]          -> id IN (?, ?, ?)
+        created__between = (a, b)   -> created BETWEEN ? AND ?
+        value__isnull = True        -> value IS NULL        (False -> IS NOT NULL)
+
+    Returns a tuple (query, params).
+    """
+    query: typing.Dict[str, sql.Operator] = dict()
+    params: typing.List[typing.Any] = list()
+    
+    for key, value in kwargs.items():
+        column, lookup = key, 'eq'
+        if '__' in key:
+            head, _, tail = key.rpartition('__')
+            if tail in LOOKUPS:
+                column, lookup = head, tail
+
+        if column in query:
+            raise ValueError(f'Multiple conditions for column {repr(column)}')
+
+        operator = LOOKUPS[lookup]
+        if operator == sql.IN:
+            values = tuple(value)
+            query[column] = (sql.IN, len(values))
+            params.extend(values)
+        
+        elif operator == sql.BETWEEN:
+            low, high = value
+            query[column] = sql.BETWEEN
+            params.extend((low, high))
+
+        elif operator == sql.IS_NULL:
+            query[column] = sql.IS_NULL if value else sql.IS_NOT_NULL
+        
+        else:
+            query[column] = operator
+            params.append(value)
+    
+    return query, tuple(params)
+
+
+def fetch_one(cursor: sqlite3.Cursor) -> typing.Optional[Namespace]:
+    return cursor.fetchone()
+
+
+def fetch_all(cursor: sqlite3.Cursor) -> typing.List[Namespace]:
+    return cursor.fetchall()
+
+
+def load_schema(schema_module: str) -> typing.Tuple[typing.Dict[str, typing.Dict[str, sql.DataType]], typing.Dict[str, sql.Index]]:
+    """
+    Run the schema module and collect the table schemas and index declarations from it.
+    Returns a tuple (schemas, indexes), both dicts are keyed by name.
+    """
+    module_namespace = runpy.run_module(schema_module)
+    schemas = dict()
+    indexes = dict()
+    
+    for key, value in module_namespace.items():
+        if key in vars(sql.datatypes) or key.startswith('_'):
+            continue
+        if isinstance(value, sql.Index):
+            indexes[key] = value
+        else:
+            schemas[key] = value
+    return schemas, indexes
+
+
+class Row(Namespace):
+    """
+    Base class for rows returned from queries.
+
+    A subclass with __slots__ is generated once for every distinct column
+    layout (see row_factory), so rows don't carry a dict of their own and
+    attribute access is a plain slot lookup. Rows are still Namespace objects
+    and their columns can be read and modified with the dotted notation:
+
+        user = database.users.get(username = 'foo')
+        user.login_attempts += 1
+
+    Assigning an attribute that isn't a column raises AttributeError.
+    """
+    __slots__ = ()
+    _fields: typing.Tuple[str, ...] = ()
+
+    __getattribute__ = object.__getattribute__
+    __setattr__ = object.__setattr__
+
+    def __init__(self, values: typing.Sequence[typing.Any]):
+        for name, value in zip(self._fields, values):
+            object.__setattr__(self, name, value)
+
+    def _asdict(self) -> typing.Dict[str, typing.Any]:
+        return { name: getattr(self, name) for name in self._fields }
+
+    def __str__(self):
+        return str(self._asdict())
+
+    def __dir__(self):
+        return list(self._asdict().keys())
+
+    def __contains__(self, key: str):
+        return key in self._fields
+
+
+ROW_CLASS_CACHE_SIZE = 1024
+
+_row_constructors: typing.Dict[typing.Tuple, typing.Callable[[typing.Sequence[typing.Any]], Namespace]] = dict()
+
+
+def make_row_class(columns: typing.Tuple[str, ...]) -> typing.Type[Row]:
+    """
+    Create a Row subclass with a slot for every column.
+    Like with collections.namedtuple, the __init__ method is generated
+    to assign all slots with a single unpacking. The column names must be
+    valid Python identifiers.
+    """
+    targets = ''.join(f'self.{col}, ' for col in columns)
+    namespace: typing.Dict[str, typing.Any] = dict()
+    exec(f'def __init__(self, values):\n    {targets}= values', namespace)
+    
+    attrs = {'__slots__': columns, '_fields': columns, '__init__': namespace['__init__']}
+    return type('Row', (Row,), attrs)
+
+
+def _make_row_constructor(columns: typing.Tuple[str, ...]) -> typing.Callable[[typing.Sequence[typing.Any]], Namespace]:
+    valid_names = all(
+        col.isidentifier() and not col.startswith('_') and not keyword.iskeyword(col)
+        for col in columns
+        )
+    if valid_names and len(set(columns)) == len(columns):
+        return make_row_class(columns)
+    
+    # Expressions like COUNT(*) or duplicate names can't be slots.
+    return lambda values: Namespace(dict(zip(columns, values)))
+
+
 def row_factory(cursor: sqlite3.Cursor, row_data: typing.Tuple[typing.Any]) -> Namespace:
-    result = dict()
-    for i, col in enumerate(cursor.description):
-        col_name = col[0]
-        result[col_name] = row_data[i]
-    return Namespace(result)
+    description = cursor.description
+    constructor = _row_constructors.get(description, None)
+    if constructor is None:
+        if len(_row_constructors) >= ROW_CLASS_CACHE_SIZE:
+            _row_constructors.clear()
+        constructor = _make_row_constructor(tuple(col[0] for col in description))
+        _row_constructors[description] = constructor
+    return constructor(row_data)
+
+
+def make_row(columns: typing.Tuple[str, ...], values: typing.Sequence[typing.Any]) -> Namespace:
+    """
+    Create a row object from column names and values, like the row_factory does.
+    """
+    constructor = _row_constructors.get(columns, None)
+    if constructor is None:
+        if len(_row_constructors) >= ROW_CLASS_CACHE_SIZE:
+            _row_constructors.clear()
+        constructor = _make_row_constructor(columns)
+        _row_constructors[columns] = constructor
+    return constructor(values)
+
+
+def create_connection(
+    path: str,
+    *,
+    pragmas: typing.Optional[Pragmas] = None,
+    readonly: bool = False,
+    check_same_thread: bool = True
+    ) -> sqlite3.Connection:
+    """
+    Open a new connection and apply the given pragmas to it.
+    The pragmas param must be a dict in the form of: { 'pragma_name': value }.
+
+    Read-only connections are opened with a 'file:...?mode=ro' URI.
+    The journal_mode pragma is skipped for them, since changing it is a write.
+    """
+    if readonly:
+        uri = 'file:' + urllib.request.pathname2url(os.path.abspath(path)) + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    else:
+        conn = sqlite3.connect(path, check_same_thread=check_same_thread)
+    
+    conn.row_factory = row_factory
+    if pragmas:
+        try:
+            cursor = conn.cursor()
+            for name, value in pragmas.items():
+                if readonly and name in READ_WRITE_PRAGMAS:
+                    continue
+                cursor.execute(sql.pragma(name, value))
+            cursor.close()
+        except Exception:
+            conn.close()
+            raise
+    return conn
+
+
+def get_pragma_profile(name: str) -> Pragmas:
+    profile = PRAGMA_PROFILES.get(name, None)
+    if profile is None:
+        raise ValueError(f'No such pragma profile: {repr(name)}')
+    return dict(profile)
@@ -0,0 +1,228 @@
+"""
+An asyncio interface for the 'ORM'.
+
+The statements are run with the blocking Database and Table classes
+on a dedicated executor thread, which owns the SQLite connection.
+The coroutines only wait for the results, so the event loop is free
+to run other tasks during the database calls.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import typing
+
+from flask_blog.orm import Database, Transaction, SchemaCache, Pragmas, INSERT_CHUNK_SIZE
+from flask_blog.common import Namespace
+
+
+class AsyncDatabase:
+    """
+    A single SQLite database file used from coroutines.
+
+    async with AsyncDatabase(path) as database:
+        user = await database.users.get(username = 'Dave')
+        await database.sessions.insert(user_id = user.id)
+
+    One connection is opened when the database is entered (or .connect() is awaited)
+    and used for all statements until .close() is awaited. All statements run on
+    the same executor thread in the order they were awaited.
+
+    Like the Database class, an AsyncDatabase object should not be shared between
+    tasks that run transactions, since the transaction would include the statements
+    of the other tasks.
+    """
+
+    def __init__(self,
+        path: str,
+        pragmas: typing.Optional[Pragmas] = None,
+        schema_cache: typing.Optional[SchemaCache] = None
+        ):
+        self.path = path
+        self.pragmas = pragmas
+        self.schema_cache = schema_cache
+        self.database: typing.Optional[Database] = None
+        self.executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+    async def run(self, function: typing.Callable, *args, **kwargs) -> typing.Any:
+        """
+        Call the function on the executor thread and wait for the result.
+        """
+        if self.executor is None:
+            raise ValueError('The database is not connected')
+        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+
+    async def connect(self):
+        """
+        Open the connection. A closed database can be connected again,
+        a new executor thread is started for it.
+        """
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        if self.database is None:
+            self.database = await self.run(self._open)
+
+
+    def _open(self) -> Database:
+        database = Database(self.path, pragmas=self.pragmas, schema_cache=self.schema_cache)
+        database.store_connection()
+        return database
+
+
+    async def close(self):
+        if self.database is not None:
+            await self.run(self.database.close_connection)
+            self.database = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+    async def __aenter__(self) -> 'AsyncDatabase':
+        await self.connect()
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+    def transaction(self) -> 'AsyncTransactionBlock':
+        """
+        Group many statements into a single transaction:
+
+        async with database.transaction():
+            await database.otps.delete(user_id = 1)
+            await database.users.delete(id = 1)
+
+        See Database.transaction.
+        """
+        return AsyncTransactionBlock(self)
+
+
+    def get_table(self, name: str) -> 'AsyncTable':
+        """
+        Return the table without touching the connection. The table is looked up
+        on the executor thread when it is first used, since a lookup may have to
+        reload the table list with the connection owned by that thread.
+        """
+        if self.database is None:
+            raise ValueError('The database is not connected')
+        return AsyncTable(self, name)
+
+
+    def __getattr__(self, attr: str) -> 'AsyncTable':
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return self.get_table(attr)
+
+
+class AsyncTransactionBlock:
+    def __init__(self, database: AsyncDatabase):
+        self.database = database
+        self.block: typing.Optional[typing.ContextManager] = None
+
+
+    async def __aenter__(self) -> AsyncDatabase:
+        if self.database.database is None:
+            raise ValueError('The database is not connected')
+
+        self.block = self.database.database.transaction()
+        await self.database.run(self.block.__enter__)
+        return self.database
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return await self.database.run(self.block.__exit__, exc_type, exc, tb)
+
+
+class AsyncTable:
+    """
+    The awaitable version of a Table, see the Table class for the full documentation.
+
+    user = await database.users.get(id = 1)
+
+    async with database.messages.update(sent = 0) as messages:
+        messages.sent = 1
+    """
+
+    def __init__(self, database: AsyncDatabase, name: str):
+        self.database = database
+        self.name = name
+
+
+    async def call(self, method: str, *args, **kwargs) -> typing.Any:
+        """
+        Call a method of the Table on the executor thread.
+        """
+        return await self.database.run(self._call, method, args, kwargs)
+
+
+    def _call(self, method: str, args: tuple, kwargs: dict) -> typing.Any:
+        if self.database.database is None:
+            raise ValueError('The database is not connected')
+        table = self.database.database.get_table(self.name)
+        return getattr(table, method)(*args, **kwargs)
+
+
+    async def get_all(self, columns: typing.Optional[typing.Sequence[str]] = None) -> typing.List[Namespace]:
+        return await self.call('get_all', columns)
+
+
+    async def get(self, columns: typing.Optional[typing.Sequence[str]] = None, **kwargs) -> Namespace:
+        return await self.call('get', columns, **kwargs)
+
+
+    async def query(
+        self,
+        order_by: typing.Union[str, typing.Sequence[str], None] = None,
+        after: typing.Any = None,
+        limit: typing.Optional[int] = None,
+        offset: typing.Optional[int] = None,
+        columns: typing.Optional[typing.Sequence[str]] = None,
+        **kwargs
+        ) -> typing.List[Namespace]:
+        return await self.call('query', order_by, after, limit, offset, columns, **kwargs)
+
+
+    async def insert(self, **kwargs):
+        return await self.call('insert', **kwargs)
+
+
+    async def insert_many(
+        self,
+        rows: typing.Iterable[typing.Union[typing.Mapping[str, typing.Any], typing.Sequence[typing.Any]]],
+        columns: typing.Optional[typing.Sequence[str]] = None,
+        chunk_size: int = INSERT_CHUNK_SIZE
+        ) -> int:
+        return await self.call('insert_many', rows, columns, chunk_size)
+
+
+    async def delete(self, **kwargs):
+        return await self.call('delete', **kwargs)
+
+
+    def update(self, **kwargs) -> 'AsyncTransaction':
+        """
+        Perform UPDATE - actions. Use the async context manager api:
+
+        async with database.messages.update(sent = 0) as messages:
+            messages.sent = 1
+        """
+        return AsyncTransaction(self, kwargs)
+
+
+class AsyncTransaction(Transaction):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc is None:
+            query = object.__getattribute__(self, 'query')
+            changes = object.__getattribute__(self, 'changes')
+            table = object.__getattribute__(self, 'table')
+            await table.call('_make_updates', query, changes)
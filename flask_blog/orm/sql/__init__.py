@@ -12,6 +12,9 @@ Author: Valtteri Rajalainen
 import io
 import re
 import typing
+import threading
+import collections.abc
+import itertools
 
 
 NAME_LENGTH = 32
@@ -19,23 +22,50 @@ NAME_RE = r'[a-zA-Z][a-zA-Z0-9_]+[a-zA-Z0-9]*'
 DECIMAL_RE = r'[0-9]+(\.[0-9]+)?'
 SQLITE_PREFIX = 'sqlite'
 
+NAME_PATTERN = re.compile(NAME_RE)
+DECIMAL_PATTERN = re.compile(DECIMAL_RE)
+
+STATEMENT_CACHE_SIZE = 256
+
 EQ = '='
+NE = '!='
+LT = '<'
+LE = '<='
+GT = '>'
+GE = '>='
+LIKE = 'LIKE'
+IN = 'IN'
+BETWEEN = 'BETWEEN'
+IS_NULL = 'IS NULL'
+IS_NOT_NULL = 'IS NOT NULL'
 
 OPERATORS = (
     EQ,
+    NE,
+    LT,
+    LE,
+    GT,
+    GE,
+    LIKE,
+    IN,
+    BETWEEN,
+    IS_NULL,
+    IS_NOT_NULL,
     )
 
+Operator = typing.Union[str, typing.Tuple[str, int]]
+
 
 def valid_name(name: str) -> bool:
     if len(name) > NAME_LENGTH:
         return False
     if name.startswith(SQLITE_PREFIX):
         return False
-    return re.fullmatch(re.compile(NAME_RE), name) is not None
+    return NAME_PATTERN.fullmatch(name) is not None
 
 
 def is_decimal(string: str) -> bool:
-    return re.fullmatch(re.compile(DECIMAL_RE), string) is not None
+    return DECIMAL_PATTERN.fullmatch(string) is not None
 
 
 class DataType:
@@ -106,6 +136,73 @@ class DataType:
         return sql
 
 
+class Index:
+    """
+    An index on one or more columns of a table.
+
+    If unique is True, a UNIQUE index is created. The where param
+    creates a partial index, it must be a dict in the form of:
+    { 'column_name': value } where value is a number, a simple string or None.
+    Multiple conditions are combined with AND.
+    """
+
+    def __init__(self, table: str, columns: typing.Sequence[str], *,
+        unique=False,
+        where=None
+        ):
+        
+        if not valid_name(table):
+            raise ValueError('Invalid table name')
+
+        if not columns or not all(valid_name(col) for col in columns):
+            raise ValueError('Invalid column name')
+
+        if where is not None and not valid_query(where):
+            raise ValueError('Invalid column name')
+
+        self.table = table
+        self.columns = tuple(columns)
+        self.unique = unique
+        self.where = where
+
+
+    def resolve(self) -> str:
+        """
+        Generate the SQL for this index: 'ON table (columns) [WHERE ...]'.
+        """
+        stream = io.StringIO()
+        stream.write(f'ON {self.table} (')
+        stream.write(', '.join(self.columns))
+        stream.write(')')
+
+        if self.where:
+            conditions = list()
+            for col, value in self.where.items():
+                if value is None:
+                    conditions.append(f'{col} IS NULL')
+                    continue
+                
+                valid_types = (str, int, float)
+                if type(value) not in valid_types:
+                    raise TypeError('Invalid type. Excpected int, float, str or None.')
+                
+                literal = str(value)
+                if is_decimal(literal) and not isinstance(value, str):
+                    conditions.append(f'{col} = {literal}')
+                elif valid_name(literal):
+                    conditions.append(f'{col} = \'{literal}\'')
+                else:
+                    raise ValueError(f'Possibly harmful value: {literal}')
+
+            stream.write(' WHERE ')
+            stream.write(' AND '.join(conditions))
+
+        stream.seek(0)
+        sql = stream.read()
+        stream.close()
+        return sql
+
+
 def valid_schema(schema: typing.Dict[str, typing.Any]):
     if not isinstance(schema, dict):
         return False
@@ -118,6 +215,49 @@ def valid_query(query: typing.Dict[str, typing.Any]) -> bool:
     return all((valid_name(name) for name in query.keys()))
 
 
+def condition(column: str, operator: Operator) -> str:
+    """
+    Generate a single parameterized condition for a WHERE - clause.
+
+    The IN - operator must be given as a tuple (IN, number of values),
+    the IS NULL and IS NOT NULL - operators take no parameters
+    and the BETWEEN - operator takes two.
+
+    condition('id', EQ) -> 'id = ?'
+    condition('id', (IN, 3)) -> 'id IN (?, ?, ?)'
+    condition('created', BETWEEN) -> 'created BETWEEN ? AND ?'
+    """
+    if isinstance(operator, tuple):
+        if len(operator) != 2 or operator[0] != IN:
+            raise ValueError('Invalid operator')
+        
+        count = operator[1]
+        if not isinstance(count, int) or count < 0:
+            raise ValueError('Invalid operator')
+        
+        placeholders = ', '.join('?' for _ in range(count))
+        return f'{column} IN ({placeholders})'
+
+    if operator not in OPERATORS or operator == IN:
+        raise ValueError('Invalid operator')
+
+    if operator in (IS_NULL, IS_NOT_NULL):
+        return f'{column} {operator}'
+
+    if operator == BETWEEN:
+        return f'{column} BETWEEN ? AND ?'
+    
+    return f'{column} {operator} ?'
+
+
+def conditions(query: typing.Dict[str, Operator]) -> str:
+    """
+    Generate the conditions of a WHERE - clause joined with AND.
+    The query must be a dict in the form of: { 'column_name': operator }.
+    """
+    return ' AND '.join(condition(col, operator) for col, operator in query.items())
+
+
 def create_table(name_: str, **schema) -> str:
     if not valid_name(name_):
         raise ValueError('Invalid table name')
@@ -146,6 +286,24 @@ def create_table(name_: str, **schema) -> str:
     return sql
 
 
+def create_index(name_: str, index: Index) -> str:
+    if not valid_name(name_):
+        raise ValueError('Invalid index name')
+
+    if not isinstance(index, Index):
+        raise ValueError('Invalid index')
+
+    unique = 'UNIQUE ' if index.unique else ''
+    return f'CREATE {unique}INDEX IF NOT EXISTS {name_} {index.resolve()}'
+
+
+def drop_index(name_: str) -> str:
+    if not valid_name(name_):
+        raise ValueError('Invalid index name')
+
+    return f'DROP INDEX {name_}'
+
+
 def drop_table(name_):
     if not valid_name(name_):
         raise ValueError('Invalid table name')
@@ -154,7 +312,14 @@ def drop_table(name_):
     return sql
 
 
-def insert(table: str, columns: typing.List[str]) -> str:
+def rename_table(name_: str, new_name: str) -> str:
+    if not valid_name(name_) or not valid_name(new_name):
+        raise ValueError('Invalid table name')
+
+    return f'ALTER TABLE {name_} RENAME TO {new_name}'
+
+
+def insert(table: str, columns: typing.List[str], *, or_ignore: bool = False) -> str:
     if not valid_name(table):
         raise ValueError('Invalid table name')
     
@@ -162,7 +327,8 @@ def insert(table: str, columns: typing.List[str]) -> str:
         raise ValueError('Invalid column name')
     
     stream = io.StringIO()
-    stream.write(f'INSERT INTO {table} (')
+    stream.write('INSERT OR IGNORE INTO ' if or_ignore else 'INSERT INTO ')
+    stream.write(f'{table} (')
     for i, col in enumerate(columns):
         stream.write(col)
         if i + 1 < len(columns):
@@ -184,7 +350,77 @@ def insert(table: str, columns: typing.List[str]) -> str:
     return sql
 
 
-def select(table: str, columns: typing.Optional[typing.List[str]] = None, **kwargs) -> str:
+def upsert(
+    table: str,
+    columns: typing.List[str],
+    conflict: typing.Optional[typing.Sequence[str]],
+    *,
+    update: typing.Optional[typing.Sequence[str]] = None
+    ) -> str:
+    """
+    INSERT with an ON CONFLICT clause for the conflict columns,
+    which must have a unique constraint or a unique index.
+
+    Without update columns the conflicting row is left as is (DO NOTHING),
+    otherwise the update columns are set to the inserted values (DO UPDATE).
+    If conflict is None, the DO NOTHING clause applies to all unique constraints.
+    Other constraint violations (NOT NULL, CHECK...) still raise an error.
+    """
+    if conflict is None:
+        if update:
+            raise ValueError('The conflict columns are required with update')
+    elif not conflict or not all([ valid_name(col) for col in conflict ]):
+        raise ValueError('Invalid conflict column name')
+
+    if update is not None and not all([ valid_name(col) for col in update ]):
+        raise ValueError('Invalid column name')
+
+    stream = io.StringIO()
+    stream.write(insert(table, columns))
+    stream.write(f' ON CONFLICT ({", ".join(conflict)})' if conflict is not None else ' ON CONFLICT')
+    
+    if update:
+        stream.write(' DO UPDATE SET ')
+        stream.write(', '.join(f'{col} = excluded.{col}' for col in update))
+    else:
+        stream.write(' DO NOTHING')
+
+    stream.seek(0)
+    sql = stream.read()
+    stream.close()
+    return sql
+
+
+def select(
+    table: str,
+    columns: typing.Optional[typing.List[str]] = None,
+    *,
+    order_by: typing.Optional[typing.Sequence[str]] = None,
+    after: bool = False,
+    limit: bool = False,
+    offset: bool = False,
+    **kwargs
+    ) -> str:
+    """
+    Generate a SELECT - statement.
+
+    The order_by param is a list of column names, a leading '-' sorts the column
+    in descending order. If after is True, a keyset condition on the ordering
+    columns is added: rows after the given values in the sort order. With many
+    ordering columns a row value comparison is used, so the columns must all
+    be sorted in the same direction.
+    The limit and offset params add placeholders for LIMIT and OFFSET.
+
+    The parameters must be given in the order: kwargs, after, limit, offset.
+
+    select('posts', order_by=['-id'], after=True, limit=True, author_id=EQ)
+
+    -> 'SELECT * FROM posts WHERE author_id = ? AND id < ? ORDER BY id DESC LIMIT ?'
+
+    select('posts', order_by=['created', 'id'], after=True)
+
+    -> 'SELECT * FROM posts WHERE (created, id) > (?, ?) ORDER BY created, id'
+    """
     if not valid_name(table):
         raise ValueError('Invalid table name')
     
@@ -193,23 +429,91 @@ def select(table: str, columns: typing.Optional[typing.List[str]] = None, **kwar
     
     if not valid_query(kwargs):
         raise ValueError('Invalid query')
+
+    ordering = [ parse_ordering(item) for item in order_by ] if order_by else []
+    if after and not ordering:
+        raise ValueError('Keyset pagination requires ordering')
+
+    if after and len({ descending for _, descending in ordering }) > 1:
+        raise ValueError('Keyset pagination requires the same direction for all ordering columns')
     
     stream = io.StringIO()
-    columns_str = '*' if columns is None else '(' + ', '.join(columns) + ')'
+    columns_str = ', '.join(columns) if columns else '*'
     stream.write(f'SELECT {columns_str} FROM {table}')
 
     if kwargs:
-        stream.write(' WHERE')
-        keys = list(kwargs.keys())
-        for i, key in enumerate(keys):
-            operator = kwargs[key]
-            if operator not in OPERATORS:
-                stream.close()
-                raise ValueError('Invalid operator')
-            
-            stream.write(f' {key} {operator} ?')
-            if i + 1 < len(keys):
-                stream.write(' AND')
+        stream.write(' WHERE ')
+        stream.write(conditions(kwargs))
+
+    if after:
+        descending = ordering[0][1]
+        operator = LT if descending else GT
+        stream.write(' AND' if kwargs else ' WHERE')
+        if len(ordering) == 1:
+            stream.write(f' {ordering[0][0]} {operator} ?')
+        else:
+            keyset_columns = ', '.join(col for col, _ in ordering)
+            placeholders = ', '.join('?' for _ in ordering)
+            stream.write(f' ({keyset_columns}) {operator} ({placeholders})')
+
+    if ordering:
+        stream.write(' ORDER BY ')
+        stream.write(', '.join(f'{col} DESC' if descending else col for col, descending in ordering))
+
+    if limit:
+        stream.write(' LIMIT ?')
+
+    if offset:
+        if not limit:
+            stream.write(' LIMIT -1')
+        stream.write(' OFFSET ?')
+
+    stream.seek(0)
+    sql = stream.read()
+    stream.close()
+    return sql
+
+
+def select_join(
+    table: str,
+    columns: typing.Sequence[str],
+    other: str,
+    other_columns: typing.Sequence[str],
+    on: typing.Tuple[str, str],
+    **kwargs
+    ) -> str:
+    """
+    Generate a SELECT - statement for a table and the matching rows of another table.
+    The conditions in kwargs apply to the first table.
+
+    select_join('sessions', ['session_id', 'user_id'], 'users', ['id', 'username'], ('user_id', 'id'), session_id=EQ)
+
+    -> 'SELECT sessions.session_id, sessions.user_id, users.id, users.username FROM sessions
+        LEFT JOIN users ON sessions.user_id = users.id WHERE sessions.session_id = ?'
+    """
+    if not valid_name(table) or not valid_name(other):
+        raise ValueError('Invalid table name')
+
+    if not columns or not other_columns:
+        raise ValueError('Columns must be provided for both tables')
+
+    if not all([ valid_name(col) for col in itertools.chain(columns, other_columns, on) ]) or len(on) != 2:
+        raise ValueError('Invalid column name')
+
+    if not valid_query(kwargs):
+        raise ValueError('Invalid query')
+
+    stream = io.StringIO()
+    stream.write('SELECT ')
+    stream.write(', '.join(itertools.chain(
+        (f'{table}.{col}' for col in columns),
+        (f'{other}.{col}' for col in other_columns)
+        )))
+    stream.write(f' FROM {table} LEFT JOIN {other} ON {table}.{on[0]} = {other}.{on[1]}')
+
+    if kwargs:
+        stream.write(' WHERE ')
+        stream.write(conditions({ f'{table}.{col}': operator for col, operator in kwargs.items() }))
 
     stream.seek(0)
     sql = stream.read()
@@ -217,6 +521,18 @@ def select(table: str, columns: typing.Optional[typing.List[str]] = None, **kwar
     return sql
 
 
+def parse_ordering(item: str) -> typing.Tuple[str, bool]:
+    """
+    Parse an ordering term: 'col' -> ('col', False), '-col' -> ('col', True).
+    The bool tells if the column is sorted in descending order.
+    """
+    descending = item.startswith('-')
+    column = item[1:] if descending else item
+    if not valid_name(column):
+        raise ValueError('Invalid column name')
+    return column, descending
+
+
 def update(table: str, columns: typing.List[str], **kwargs) -> str:
     if not valid_name(table):
         raise ValueError('Invalid table name')
@@ -237,17 +553,8 @@ def update(table: str, columns: typing.List[str], **kwargs) -> str:
             stream.write(',')
 
     if kwargs:
-        keys = list(kwargs.keys())
-        stream.write(' WHERE')
-        for i, key in enumerate(keys):
-            operator = kwargs[key]
-            if operator not in OPERATORS:
-                stream.close()
-                raise ValueError('Invalid operator')
-            
-            stream.write(f' {key} {operator} ?')
-            if i + 1 < len(keys):
-                stream.write(' AND')
+        stream.write(' WHERE ')
+        stream.write(conditions(kwargs))
 
     stream.seek(0)
     sql = stream.read()
@@ -266,17 +573,8 @@ def delete(table: str, **kwargs) -> str:
     stream.write(f'DELETE FROM {table}')
 
     if kwargs:
-        stream.write(' WHERE')
-        keys = list(kwargs.keys())
-        for i, key in enumerate(keys):
-            operator = kwargs[key]
-            if operator not in OPERATORS:
-                stream.close()
-                raise ValueError('Invalid operator')
-            
-            stream.write(f' {key} {operator} ?')
-            if i + 1 < len(keys):
-                stream.write(' AND')
+        stream.write(' WHERE ')
+        stream.write(conditions(kwargs))
 
     stream.seek(0)
     sql = stream.read()
@@ -284,5 +582,109 @@ def delete(table: str, **kwargs) -> str:
     return sql
 
 
+def pragma(name_: str, value: typing.Union[int, str]) -> str:
+    if not valid_name(name_):
+        raise ValueError('Invalid pragma name')
+
+    if type(value) is not int and not (isinstance(value, str) and valid_name(value)):
+        raise ValueError(f'Possibly harmful value: {value}')
+
+    return f'PRAGMA {name_} = {value}'
+
+
 def list_tables() -> str:
-    return 'SELECT name FROM sqlite_master WHERE type = \'table\' AND name NOT LIKE \'sqlite%\';'
\ No newline at end of file
+    return 'SELECT name FROM sqlite_master WHERE type = \'table\' AND name NOT LIKE \'sqlite%\';'
+
+
+def list_indexes() -> str:
+    return 'SELECT name FROM sqlite_master WHERE type = \'index\' AND name NOT LIKE \'sqlite%\';'
+
+
+def list_schema() -> str:
+    return 'SELECT type, name, tbl_name FROM sqlite_master WHERE type IN (\'table\', \'index\') AND name NOT LIKE \'sqlite%\';'
+
+
+def schema_version() -> str:
+    return 'PRAGMA schema_version'
+
+
+def table_info(table: str) -> str:
+    if not valid_name(table):
+        raise ValueError('Invalid table name')
+    
+    return f'PRAGMA table_info({table})'
+
+
+class StatementCache:
+    """
+    A bounded cache for generated SQL statements.
+
+    Statements are keyed on the generator function and its arguments
+    (table, columns, operators...), never on the query parameters,
+    so the same statement text is shared by all queries with the same shape.
+    Generators raising an error for invalid input are never cached.
+
+    The lookups don't take the lock, it's only held when a statement is added.
+    When the cache is full, the oldest statement is dropped. The hit and miss
+    counts are not synchronized and may be slightly off with many threads.
+    """
+
+    def __init__(self, max_size: int = STATEMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self.statements: typing.Dict[typing.Hashable, str] = dict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+
+    def get(self, generator: typing.Callable[..., str], *args, **kwargs) -> str:
+        # Column lists are the only unhashable arguments on the hot paths.
+        key = (generator, *[ tuple(arg) if type(arg) is list else arg for arg in args ], *kwargs.items())
+        try:
+            sql = self.statements.get(key, None)
+        except TypeError:
+            key = (generator, _freeze(args), _freeze(kwargs))
+            sql = self.statements.get(key, None)
+        
+        if sql is not None:
+            self.hits += 1
+            return sql
+
+        sql = generator(*args, **kwargs)
+        with self.lock:
+            self.misses += 1
+            if key not in self.statements and len(self.statements) >= self.max_size:
+                self.statements.pop(next(iter(self.statements)))
+            self.statements[key] = sql
+        return sql
+
+
+    def clear(self):
+        with self.lock:
+            self.statements.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+    def __len__(self) -> int:
+        return len(self.statements)
+
+
+statement_cache = StatementCache()
+
+
+def cached(generator: typing.Callable[..., str], *args, **kwargs) -> str:
+    """
+    Return the SQL generated by generator(*args, **kwargs) using the module level statement cache.
+
+    cached(select, 'users', None, id=EQ) == select('users', None, id=EQ)
+    """
+    return statement_cache.get(generator, *args, **kwargs)
+
+
+def _freeze(value: typing.Any) -> typing.Hashable:
+    if isinstance(value, dict):
+        return tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple, collections.abc.KeysView)):
+        return tuple(_freeze(item) for item in value)
+    return value
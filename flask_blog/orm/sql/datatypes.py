@@ -1,4 +1,4 @@
-from flask_blog.orm.sql import DataType
+from flask_blog.orm.sql import DataType, Index
 
 
 __all__ = [
@@ -6,6 +6,7 @@ __all__ = [
     'real',
     'text',
     'blob',
+    'index',
 ]
 
 
@@ -23,3 +24,7 @@ def text(**kwargs) -> DataType:
 
 def blob(**kwargs) -> DataType:
     return DataType('BLOB', **kwargs)
+
+
+def index(table: str, *columns: str, **kwargs) -> Index:
+    return Index(table, columns, **kwargs)
@@ -24,7 +24,7 @@ users = {
 sessions = {
     'session_id': blob(),
     'csrf_token': blob(),
-    'expires': text(not_null = True),
+    'expires': integer(not_null = True),
     'user_id': integer(not_null = True, default = 0),
 }
 
@@ -32,7 +32,7 @@ sessions = {
 otps = {
     'id': integer(primary_key = True, auto_increment = True),
     'value': blob(),
-    'expires': text(not_null = True),
+    'expires': integer(not_null = True),
     'type': text(not_null = True),
     'user_id': integer(not_null = True, foreign_key = ('user_id', 'users', 'id')),
 }
@@ -40,7 +40,24 @@ otps = {
 
 posts = {
     'id': integer(primary_key = True, auto_increment = True),
-    'created': text(not_null = True),
+    'created': integer(not_null = True),
     'content': text(not_null = True),
     'author_id': integer(not_null = True, foreign_key = ('author_id', 'users', 'id')),
 }
+
+
+session_revocations = {
+    'session_id': blob(),
+    'user_id': integer(not_null = True, default = 0),
+    'revoked': integer(not_null = True),
+    'expires': integer(not_null = True),
+}
+
+
+sessions_session_id_index = index('sessions', 'session_id', unique = True)
+sessions_expires_index = index('sessions', 'expires')
+otps_value_unique_index = index('otps', 'value', unique = True)
+otps_user_id_type_index = index('otps', 'user_id', 'type')
+otps_expires_index = index('otps', 'expires')
+posts_author_id_index = index('posts', 'author_id')
+revocations_expires_index = index('session_revocations', 'expires')
@@ -97,14 +97,13 @@ def login_user(user: Namespace):
     End the anonymous session and create new session with the given userid.
     Set the flask.g.user to the user namespace object. Resets the login attempts.
     """
-    session_id = flask.session[SESSIONID]
-    try:
-        sessions.end_session(bytes.fromhex(session_id))
-    except ValueError:
-        pass
+    session_id = flask.session.get(SESSIONID, None)
+    if session_id is not None:
+        sessions.end_cookie_session(session_id)
 
     session = sessions.create_new_session(user.id)
-    flask.session[SESSIONID] = session.id.hex()
+    flask.g.session = session
+    flask.session[SESSIONID] = sessions.session_cookie_value(session)
     flask.g.user = user
     
     with models.users.update(id = user.id) as user_model:
@@ -121,7 +120,7 @@ def logout_user(user_session: Session):
         
     session = sessions.create_new_session()
     flask.g.session = session
-    flask.session[SESSIONID] = session.id.hex()
+    flask.session[SESSIONID] = sessions.session_cookie_value(session)
 
 
 def verify_user(userid: int):
@@ -173,13 +172,13 @@ def validate_registration_form(
         error = 'Invalid username.'
         error += ' Username must only contain lowercase letters a-z, numbers and underscores.'
 
-    elif models.users.get(username = username) is not None:
+    elif models.users.get(columns = ['id'], username = username) is not None:
         error = 'Username is in use.'
 
     elif not valid_email(email):
         error = 'Invalid email address.'
     
-    elif models.users.get(email = email):
+    elif models.users.get(columns = ['id'], email = email):
         error = 'Email is in use.'
 
     elif not valid_password(password):
@@ -249,10 +248,10 @@ def validate_email_verification(form: types.Dict[str, str], session: Session) ->
     """
     email_token = models.otps.get(user_id=session.user_id, type=OTP.EMAIL)
     if email_token is None:
-        attrs = {'value': b'\x00\x01', 'id': 0, 'type': OTP.ACCOUNT_LOCK, 'expires': str(Timestamp())}
+        attrs = {'value': b'\x00\x01', 'id': 0, 'type': OTP.ACCOUNT_LOCK, 'expires': int(Timestamp())}
         email_token = Namespace(attrs)
 
-    is_expired = Timestamp() > Timestamp.from_str(email_token.expires)
+    is_expired = Timestamp() > Timestamp.load(email_token.expires)
 
     sent_token = form.get('verification_token', '00')
     try:
@@ -282,10 +281,10 @@ def validate_password_reset(form: types.Dict[str, str], session: Session) -> typ
         
         reset_token = models.otps.get(user_id = user.id, type = OTP.PASSWORD_RESET)
         if reset_token is None:
-            attrs = {'value': b'\x00\x01', 'id': 0, 'type': OTP.ACCOUNT_LOCK, 'expires': str(Timestamp())}
+            attrs = {'value': b'\x00\x01', 'id': 0, 'type': OTP.ACCOUNT_LOCK, 'expires': int(Timestamp())}
             reset_token = Namespace(attrs)
 
-        is_expired = Timestamp() > Timestamp.from_str(reset_token.expires)
+        is_expired = Timestamp() > Timestamp.load(reset_token.expires)
 
         sent_token = form.get('otp', '00')
         try:
@@ -347,7 +346,7 @@ def unlock_user_account(form: types.Dict[str, str], session: Session) -> types.O
     user_id = 0 if user is None else user.id
     unlock_token = models.otps.get(user_id = user_id, type = OTP.ACCOUNT_LOCK)
     if unlock_token is None:
-        attrs = {'value': b'\x00\x01', 'id': 0, 'type': OTP.ACCOUNT_LOCK, 'expires': str(Timestamp())}
+        attrs = {'value': b'\x00\x01', 'id': 0, 'type': OTP.ACCOUNT_LOCK, 'expires': int(Timestamp())}
         unlock_token = Namespace(attrs)
 
     sent_token = form.get('unlock_token', '00')
@@ -357,7 +356,7 @@ def unlock_user_account(form: types.Dict[str, str], session: Session) -> types.O
         src = b'\x00'
 
     valid_token = matching_tokens(src, unlock_token.value)
-    is_expired = Timestamp() > Timestamp.from_str(unlock_token.expires)
+    is_expired = Timestamp() > Timestamp.load(unlock_token.expires)
 
     conditions = [
         user is not None,
@@ -385,7 +384,7 @@ def record_login_attempt(form: types.Dict[str, str]) -> types.Tuple[types.Option
 
     if user.is_locked:
         lock = models.otps.get(user_id = user.id, type = OTP.ACCOUNT_LOCK)
-        if Timestamp() < Timestamp.from_str(lock.expires):
+        if Timestamp() < Timestamp.load(lock.expires):
             return None, False
         
         user.is_locked = 0
@@ -425,18 +424,22 @@ def generate_otp(user_id: int, otp_type: str, lifetime: int) -> types.Tuple[byte
     if otp_type not in OTP_TYPES:
         raise TypeError('Invalid OTP type.')
     
-    otp = os.urandom(OTP_LENGTH)
-    while models.otps.get(value = otp) is not None:
-        otp = os.urandom(OTP_LENGTH)
-
     expires = Timestamp(lifetime)
-    models.otps.insert(
-        value = otp,
-        expires = str(expires),
-        type = otp_type,
-        user_id = user_id
-        )
-    return otp, expires
+    
+    # The unique index on value rejects the (very unlikely) duplicates.
+    # The conflict target is left out, so databases created before the index
+    # was added still work.
+    while True:
+        otp = os.urandom(OTP_LENGTH)
+        inserted = models.otps.upsert(
+            None,
+            value = otp,
+            expires = int(expires),
+            type = otp_type,
+            user_id = user_id
+            )
+        if inserted:
+            return otp, expires
 
 
 def send_verification_email(reciever: str, otp: bytes, expires: Timestamp, base_url: str):
@@ -9,9 +9,13 @@ import os
 import flask
 import codecs
 import hmac
+import struct
+import time
+import threading
+import collections
 
 import flask_blog.typing as types
-from flask_blog.common import Timestamp, Session
+from flask_blog.common import Timestamp, Session, Namespace
 from flask_blog.security.utils import *
 
 if types.TYPE_CHECKING:
@@ -22,59 +26,534 @@ else:
 
 
 __all__ = [
+    'LazySession',
     'create_new_session',
     'end_session',
-    'load_user_session'
+    'load_user_session',
+    'load_session_and_user',
+    'end_user_sessions',
+    'session_cookie_value',
 ]
 
 
-def create_new_session(userid: int = 0) -> Session:
+SESSION_BACKENDS = ('database', 'signed')
+
+# session id, user id, issued (ms), expires (s)
+SIGNED_SESSION_FORMAT = struct.Struct(f'>{SESSIONID_RAND_BYTES}sQQQ')
+SIGNATURE_LENGTH = hashlib.sha256().digest_size
+
+
+CsrfTokenStrategy = types.Callable[[bytes, bytes], bytes]
+
+
+def hmac_csrf_token(session_id: bytes, secret_key: bytes) -> bytes:
+    return hmac.new(secret_key, session_id, PBKDF2_HASH).digest()
+
+
+def random_csrf_token(session_id: bytes, secret_key: bytes) -> bytes:
+    return os.urandom(CSRF_TOKEN_BYTES)
+
+
+def pbkdf2_csrf_token(session_id: bytes, secret_key: bytes) -> bytes:
+    return hashlib.pbkdf2_hmac(PBKDF2_HASH, session_id, secret_key, PBKDF2_ITERATIONS)
+
+
+CSRF_TOKEN_STRATEGIES: types.Dict[str, CsrfTokenStrategy] = {
+    'hmac': hmac_csrf_token,
+    'random': random_csrf_token,
+    'pbkdf2': pbkdf2_csrf_token,
+    }
+
+
+def get_csrf_token_strategy() -> CsrfTokenStrategy:
     """
-    Create and store new session linked to the given userid.
-    Returns a Session object.
+    Return the token function selected with the CSRF_TOKEN_STRATEGY setting.
+
+    The tokens are stored with the sessions and compared against the stored value,
+    so changing the strategy doesn't invalidate the existing sessions.
     """
-    app = flask.current_app
-    secret_key = app.config['SECRET_KEY']
+    strategy = flask.current_app.config.get('CSRF_TOKEN_STRATEGY', 'hmac')
+    if callable(strategy):
+        return strategy
     
+    if strategy not in CSRF_TOKEN_STRATEGIES:
+        raise ValueError(f'Invalid CSRF token strategy: {repr(strategy)}')
+    return CSRF_TOKEN_STRATEGIES[strategy]
+
+
+def get_secret_key() -> bytes:
+    secret_key = flask.current_app.config['SECRET_KEY']
     if not isinstance(secret_key, bytes):
         secret_key = codecs.encode(secret_key, encoding='ascii', errors='surrogateescape')
+    return secret_key
+
+
+def signed_sessions_enabled() -> bool:
+    backend = flask.current_app.config.get('SESSION_BACKEND', 'database')
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f'Invalid session backend: {repr(backend)}')
+    return backend == 'signed'
+
+
+def create_new_session(userid: int = 0) -> Session:
+    """
+    Create and store new session linked to the given userid.
+    Returns a Session object.
+
+    With the signed session backend nothing is stored,
+    the session is kept in the cookie (see SignedSession).
+    """
+    secret_key = get_secret_key()
+    if signed_sessions_enabled():
+        return SignedSession.create(userid, secret_key)
     
+    generate_csrf_token = get_csrf_token_strategy()
+    expires = Timestamp(SESSION_LIFETIME)
     
+    # The unique index on session_id rejects the (very unlikely) duplicates.
+    # The conflict target is left out, so databases created before the index
+    # was added still work.
     while True:
         session_id = os.urandom(SESSIONID_RAND_BYTES)
-        if models.sessions.get(session_id = session_id) is None:
+        csrf_token = generate_csrf_token(session_id, secret_key)
+
+        params = {
+            'session_id': session_id,
+            'csrf_token': csrf_token,
+            'expires': int(expires),
+            'user_id': userid,
+            }
+        if models.sessions.upsert(None, **params):
             break
+    
+    return Session(session_id, csrf_token, expires, userid)
 
-    csrf_token = hashlib.pbkdf2_hmac(PBKDF2_HASH, session_id, secret_key, PBKDF2_ITERATIONS)
-    expires = Timestamp(SESSION_LIFETIME)
 
-    params = {
-        'session_id': session_id,
-        'csrf_token': csrf_token,
-        'expires': str(expires),
-        'user_id': userid,
-        }
-    models.sessions.insert(**params)
+class LazySession(Session):
+    """
+    An anonymous session, which is stored in the database
+    only when its id or CSRF token is used for the first time.
+
+    Requests that don't render or submit forms can use
+    the anonymous session without writing anything.
+    """
+
+    def __init__(self):
+        # The id and the CSRF token are read from the stored session, see .materialize().
+        super().__init__(b'', b'', Timestamp(SESSION_LIFETIME), 0)
+        self.session: types.Optional[Session] = None
+
+    @property
+    def id(self) -> bytes:
+        return self.materialize().id
+
+    @property
+    def csrf_token(self) -> bytes:
+        return self.materialize().csrf_token
+
+    @property
+    def is_stored(self) -> bool:
+        return self.session is not None
+
+    def materialize(self) -> Session:
+        if self.session is None:
+            self.session = create_new_session()
+            self.expires = self.session.expires
+        return self.session
+
+
+class SignedSession(Session):
+    """
+    A session kept in a HMAC-signed cookie instead of the sessions table.
+
+    The cookie contains the session id, user id, the creation time and the expiry time.
+    The CSRF token is derived from the session id with hmac_csrf_token,
+    since there is nowhere to store a random token.
+
+    Ended sessions are recorded in the session_revocations table, see RevocationList.
+    """
+
+    def __init__(self, session_id: bytes, csrf_token: bytes, expires: Timestamp, user_id: int, issued: int, expires_epoch: int):
+        super().__init__(session_id, csrf_token, expires, user_id)
+        self.issued = issued
+        self.expires_epoch = expires_epoch
+
+    @classmethod
+    def create(cls, user_id: int, secret_key: bytes) -> 'SignedSession':
+        session_id = os.urandom(SESSIONID_RAND_BYTES)
+        issued = int(time.time() * 1000)
+        expires = issued // 1000 + SESSION_LIFETIME * 3600
+        return cls(session_id, hmac_csrf_token(session_id, secret_key), Timestamp.from_epoch(expires), user_id, issued, expires)
+
+    @classmethod
+    def decode(cls, token: bytes, secret_key: bytes) -> types.Optional['SignedSession']:
+        """
+        Return the session in the token, or None if the token
+        is malformed, the signature doesn't match or the session is expired.
+        """
+        if len(token) != SIGNED_SESSION_FORMAT.size + SIGNATURE_LENGTH:
+            return None
+
+        payload, signature = token[:SIGNED_SESSION_FORMAT.size], token[SIGNED_SESSION_FORMAT.size:]
+        if not hmac.compare_digest(signature, sign_session(payload, secret_key)):
+            return None
+        
+        session_id, user_id, issued, expires = SIGNED_SESSION_FORMAT.unpack(payload)
+        if expires <= time.time():
+            return None
+        return cls(session_id, hmac_csrf_token(session_id, secret_key), Timestamp.from_epoch(expires), user_id, issued, expires)
+
+    def encode(self, secret_key: bytes) -> bytes:
+        payload = SIGNED_SESSION_FORMAT.pack(self.id, self.user_id, self.issued, self.expires_epoch)
+        return payload + sign_session(payload, secret_key)
+
+
+def sign_session(payload: bytes, secret_key: bytes) -> bytes:
+    return hmac.new(secret_key, b'session:' + payload, hashlib.sha256).digest()
+
+
+class RevocationList:
+    """
+    An in-memory copy of the session_revocations table.
+
+    The table is reloaded when the copy is older than ttl seconds, the revocations
+    made by this process are added to the copy immediately.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.sessions: types.Set[bytes] = set()
+        self.users: types.Dict[int, int] = dict()
+        self.loaded: types.Optional[float] = None
+
+
+    def is_revoked(self, session: SignedSession) -> bool:
+        return self.revoked_since(session, session.issued)
+
+
+    def revoked_since(self, session: Session, since: int) -> bool:
+        """
+        Check if the session, or all sessions of its user,
+        were revoked after the given time (epoch milliseconds).
+        """
+        if self.loaded is None or time.monotonic() - self.loaded > self.ttl:
+            self.reload()
+        
+        with self.lock:
+            if session.id in self.sessions:
+                return True
+            return since <= self.users.get(session.user_id, -1)
+
+
+    def reload(self):
+        now = int(time.time())
+        table = get_revocations_table()
+        rows = table.query(expires__gt = now) if table is not None else []
+        
+        with self.lock:
+            self.sessions = { row.session_id for row in rows if row.session_id is not None }
+            self.users = dict()
+            for row in rows:
+                if row.session_id is None:
+                    self.users[row.user_id] = max(row.revoked, self.users.get(row.user_id, 0))
+            self.loaded = time.monotonic()
+
+
+    def revoke_session(self, session_id: bytes, required: bool = True):
+        """
+        Record the revocation of the session. If required is False,
+        a missing session_revocations table is ignored.
+        """
+        expires = int(time.time()) + SESSION_LIFETIME * 3600
+        self.record(required, session_id = session_id, revoked = int(time.time() * 1000), expires = expires)
+        with self.lock:
+            self.sessions.add(session_id)
+
+
+    def revoke_user(self, user_id: int, required: bool = True):
+        """
+        Revoke all sessions of the user created before this moment, see revoke_session.
+        """
+        revoked = int(time.time() * 1000)
+        expires = int(time.time()) + SESSION_LIFETIME * 3600
+        self.record(required, user_id = user_id, revoked = revoked, expires = expires)
+        with self.lock:
+            self.users[user_id] = revoked
+
+
+    def record(self, required: bool, **kwargs):
+        table = get_revocations_table()
+        if table is None:
+            if required:
+                raise AttributeError('No session_revocations table, run the create-tables command')
+            return
+        table.insert(**kwargs)
+
+
+def get_revocations_table() -> types.Optional[types.DatabaseTable]:
+    """
+    Return the session_revocations table, or None for databases
+    created before the table was added (see the create-tables command).
+    """
+    try:
+        return models.session_revocations
+    except AttributeError:
+        return None
+
+
+revocation_lists: types.Dict[str, RevocationList] = dict()
+revocation_lists_lock = threading.Lock()
+
+
+def get_revocation_list() -> RevocationList:
+    """
+    Return the process-wide revocation list of the current database.
+    """
+    config = flask.current_app.config
+    with revocation_lists_lock:
+        revocations = revocation_lists.get(config['DATABASE'], None)
+        if revocations is None:
+            revocations = RevocationList(config.get('SESSION_REVOCATION_CACHE_TTL', 5.0))
+            revocation_lists[config['DATABASE']] = revocations
+    return revocations
+
+
+class SessionCache:
+    """
+    A bounded LRU cache of the sessions loaded from the sessions table.
+
+    Entries are kept for ttl seconds, or until the session expires.
+    Unknown session ids are cached as None, so repeated lookups
+    with the same invalid cookie don't reach the database either.
+
+    Other processes' changes are seen after ttl seconds. If a revocation list
+    is given, the sessions ended by other processes are dropped from the cache
+    as soon as the revocation list is reloaded, see end_session.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 30.0, revocations: types.Optional[RevocationList] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.revocations = revocations
+        self.lock = threading.Lock()
+        self.entries: types.OrderedDict[bytes, types.Tuple[float, int, types.Optional[Session]]] = collections.OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+
+    def get(self, session_id: bytes) -> types.Tuple[bool, types.Optional[Session]]:
+        """
+        Returns (found, session). The session is None for cached unknown ids.
+        """
+        with self.lock:
+            entry = self.entries.get(session_id, None)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[session_id]
+                self.misses += 1
+                return False, None
+            
+            self.entries.move_to_end(session_id)
+            _, cached, session = entry
+
+        # Checked without the lock, the revocation list may reload the table.
+        if session is not None and self.revocations is not None and self.revocations.revoked_since(session, cached):
+            with self.lock:
+                self.entries.pop(session_id, None)
+                self.misses += 1
+            return False, None
+
+        with self.lock:
+            if session is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+        return True, session
+
+
+    def put(self, session_id: bytes, session: types.Optional[Session]):
+        lifetime = self.ttl
+        if session is not None:
+            lifetime = min(lifetime, int(session.expires) - time.time())
+        
+        with self.lock:
+            self.entries[session_id] = (time.monotonic() + lifetime, int(time.time() * 1000), session)
+            self.entries.move_to_end(session_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+    def invalidate(self, session_id: bytes):
+        with self.lock:
+            self.entries.pop(session_id, None)
+
+
+    def invalidate_user(self, user_id: int):
+        with self.lock:
+            for session_id, (_, _, session) in list(self.entries.items()):
+                if session is not None and session.user_id == user_id:
+                    del self.entries[session_id]
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+    def stats(self) -> types.Dict[str, float]:
+        with self.lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+                }
+
+
+session_caches: types.Dict[str, SessionCache] = dict()
+session_caches_lock = threading.Lock()
+
+
+def get_session_cache() -> types.Optional[SessionCache]:
+    """
+    Return the process-wide session cache of the current database,
+    or None if the cache is disabled (SESSION_CACHE_SIZE is 0).
+    """
+    config = flask.current_app.config
+    max_size = config.get('SESSION_CACHE_SIZE', 0)
+    if not max_size:
+        return None
     
-    return Session(session_id, csrf_token, expires, userid)
+    with session_caches_lock:
+        cache = session_caches.get(config['DATABASE'], None)
+        if cache is None:
+            cache = SessionCache(max_size, config.get('SESSION_CACHE_TTL', 30.0), get_revocation_list())
+            session_caches[config['DATABASE']] = cache
+    return cache
+
+
+def session_cookie_value(session: Session) -> str:
+    """
+    Return the value stored in the session cookie for the session.
+    """
+    if isinstance(session, LazySession):
+        session = session.materialize()
+    if isinstance(session, SignedSession):
+        return session.encode(get_secret_key()).hex()
+    return session.id.hex()
 
 
 def get_session_by_id(session_id: bytes) -> types.Optional[Session]:
     row = models.sessions.get(session_id = session_id)
     if not row:
         return None
+    return session_from_row(row)
+
+
+def get_session_and_user_by_id(session_id: bytes) -> types.Tuple[types.Optional[Session], types.Optional[Namespace]]:
+    """
+    Load the session and the user of the session with a single query.
+    """
+    result = models.sessions.get_with(models.users, on = ('user_id', 'id'), session_id = session_id)
+    if result is None:
+        return None, None
     
+    row, user = result
+    return session_from_row(row), user
+
+
+def session_from_row(row: Namespace) -> Session:
     session = Session(
         row.session_id,
         row.csrf_token,
-        Timestamp.from_str(row.expires),
+        Timestamp.load(row.expires),
         row.user_id
         )
     return session
 
 
+def get_stored_session(session_id: bytes) -> types.Optional[Session]:
+    """
+    Like get_session_by_id, but uses the session cache if it is enabled.
+    """
+    cache = get_session_cache()
+    if cache is None:
+        return get_session_by_id(session_id)
+    
+    found, session = cache.get(session_id)
+    if not found:
+        session = get_session_by_id(session_id)
+        cache.put(session_id, session)
+    return session
+
+
 def end_session(session_id: bytes):
-    models.sessions.delete(session_id = session_id)
+    """
+    End the session. With the session cache enabled, the ended session is also
+    recorded in the session_revocations table, so the other processes drop it
+    from their caches within SESSION_REVOCATION_CACHE_TTL seconds. Databases
+    without the table only invalidate the cache of this process.
+    """
+    cache = get_session_cache()
+    if signed_sessions_enabled():
+        get_revocation_list().revoke_session(session_id)
+    else:
+        models.sessions.delete(session_id = session_id)
+        if cache is not None:
+            get_revocation_list().revoke_session(session_id, required = False)
+    
+    if cache is not None:
+        cache.invalidate(session_id)
+
+
+def end_user_sessions(user_id: int):
+    """
+    End all sessions of the given user, see end_session.
+    """
+    cache = get_session_cache()
+    if signed_sessions_enabled():
+        get_revocation_list().revoke_user(user_id)
+    else:
+        models.sessions.delete(user_id = user_id)
+        if cache is not None:
+            get_revocation_list().revoke_user(user_id, required = False)
+    
+    if cache is not None:
+        cache.invalidate_user(user_id)
+
+
+def end_cookie_session(raw_session_id: str):
+    """
+    End the session stored in the session cookie, if it is valid.
+    Anonymous signed sessions are not revoked, they can't be reused
+    to access anything after the user has logged in.
+    """
+    if signed_sessions_enabled():
+        session = load_signed_session(raw_session_id)
+        if session is not None and not session.is_anonymous:
+            end_session(session.id)
+        return
+
+    try:
+        end_session(bytes.fromhex(raw_session_id))
+    except (ValueError, TypeError):
+        pass
+
+
+def load_signed_session(raw_session_id: str) -> types.Optional[SignedSession]:
+    try:
+        token = bytes.fromhex(raw_session_id)
+    except (ValueError, TypeError):
+        return None
+
+    session = SignedSession.decode(token, get_secret_key())
+    if session is None or get_revocation_list().is_revoked(session):
+        return None
+    return session
 
 
 def load_user_session(raw_session_id: str) -> Session:
@@ -82,21 +561,75 @@ def load_user_session(raw_session_id: str) -> Session:
     Always returns a Session object.
 
     If the raw session id is None, invalid type, non existing or the corresponding session
-    is expired, a new anonymus session is created.
+    is expired, a new anonymus LazySession is returned. It is stored on first use.
     """
     if raw_session_id is None:
-        return create_new_session()
+        return LazySession()
+
+    if signed_sessions_enabled():
+        signed_session = load_signed_session(raw_session_id)
+        return signed_session if signed_session is not None else LazySession()
     
     try:
         session_id = bytes.fromhex(raw_session_id)
     
     except (ValueError, TypeError):
-        return create_new_session()
+        return LazySession()
 
     else:
-        session = get_session_by_id(session_id)
+        session = get_stored_session(session_id)
         if session is None:
-            return create_new_session()
+            return LazySession()
         if session.is_expired:
-            return create_new_session()
-        return session
\ No newline at end of file
+            return LazySession()
+        return session
+
+
+def load_session_and_user(raw_session_id: str) -> types.Tuple[Session, types.Optional[Namespace]]:
+    """
+    Like load_user_session, but also returns the user of the session,
+    or None for anonymous sessions.
+
+    If the session isn't cached, the session and the user are loaded
+    with a single query.
+    """
+    if raw_session_id is None:
+        return LazySession(), None
+
+    if signed_sessions_enabled():
+        signed_session = load_user_session(raw_session_id)
+        return signed_session, get_session_user(signed_session)
+
+    try:
+        session_id = bytes.fromhex(raw_session_id)
+    
+    except (ValueError, TypeError):
+        return LazySession(), None
+
+    cache = get_session_cache()
+    found, session = cache.get(session_id) if cache is not None else (False, None)
+    if found:
+        user = get_session_user(session) if session is not None and not session.is_expired else None
+        # The user was deleted after the session was cached.
+        if session is not None and not session.is_anonymous and user is None:
+            found = False
+    
+    if not found:
+        session, user = get_session_and_user_by_id(session_id)
+        if cache is not None:
+            cache.put(session_id, session)
+    
+    if session is None or session.is_expired:
+        return LazySession(), None
+    if session.is_anonymous:
+        return session, None
+    # The session of a deleted user.
+    if user is None:
+        return LazySession(), None
+    return session, user
+
+
+def get_session_user(session: Session) -> types.Optional[Namespace]:
+    if session.is_anonymous:
+        return None
+    return models.users.get(id = session.user_id)
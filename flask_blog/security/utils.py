@@ -16,6 +16,7 @@ PBKDF2_HASH = 'sha256'
 
 SALT_LENGTH = 32
 SESSIONID_RAND_BYTES = 32
+CSRF_TOKEN_BYTES = 32
 SESSION_LIFETIME = 24
 
 MAX_LOGIN_ATTEMPTS = 10
@@ -5,9 +5,12 @@ from types import ModuleType
 from typing import (
     List,
     Dict,
+    Set,
+    OrderedDict,
     Tuple,
     Callable,
     Any,
+    ContextManager,
     
     Union, 
     Optional,
@@ -229,7 +229,7 @@ def test_account_unlocking(app, db):
         user_id = 1,
         value = b'\x00\x01',
         type = auth.OTP.ACCOUNT_LOCK,
-        expires = str(Timestamp(1))
+        expires = int(Timestamp(1))
         )
 
     client = TestClient(app)
@@ -305,7 +305,7 @@ def test_anonymous_password_reset(app, db):
         )
     db.get_table('otps').insert(
         value = b'\x00\x01',
-        expires=str(Timestamp(1)),
+        expires=int(Timestamp(1)),
         user_id = 1,
         type = auth.OTP.PASSWORD_RESET
         )
@@ -376,7 +376,7 @@ def test_login_requirement(app, db):
 
     with client:
         response = client.get('/')
-        session_id = flask.session[SESSIONID]
+        session_id = flask.session.get(SESSIONID, None)
     try:
         redirect_location = response.headers['Location']
     except:
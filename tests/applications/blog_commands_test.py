@@ -3,6 +3,7 @@ from microtest.utils import Namespace
 
 import flask
 import flask_blog.applications.blog as blog_application
+from flask_blog.orm.sql.datatypes import text
 
 
 @microtest.reset
@@ -28,6 +29,69 @@ def test_init_db_cmd(app, db):
         assert 'OK' in result.output
 
 
+@microtest.test
+def test_init_db_cmd_on_new_database():
+    import os
+    import tempfile
+    import flask_blog
+    import flask_blog.models
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'new.db')
+        app = flask_blog.create_app({'TESTING': True, 'DATABASE': path, 'DATABASE_PRAGMA_PROFILE': 'default'})
+        assert app.config['DATABASE_READ_POOL_SIZE'] > 0
+
+        result = app.test_cli_runner().invoke(args=['init-db'])
+        assert 'OK' in result.output
+        assert os.path.exists(path)
+
+        with app.app_context():
+            assert flask_blog.models.users.get_all() == []
+
+
+@microtest.test
+def test_create_indexes_cmd(app, db):
+    runner = app.test_cli_runner()
+    
+    result = runner.invoke(args=['create-indexes'])
+    assert 'OK' in result.output
+    assert 'Created 0 missing indexes' in result.output
+
+    db.conn.execute('DROP INDEX posts_author_id_index')
+    result = runner.invoke(args=['create-indexes'])
+    assert 'Created 1 missing indexes' in result.output
+    assert 'posts_author_id_index' in result.output
+    assert 'posts_author_id_index' in db.list_indexes()
+
+    # Databases created before the session_revocations table was added.
+    db.drop_table('session_revocations')
+    db.conn.execute('DROP INDEX posts_author_id_index')
+    result = runner.invoke(args=['create-indexes'])
+    assert 'OK' in result.output
+    assert 'Created 1 missing indexes' in result.output
+    assert 'Skipped 1 indexes' in result.output
+    assert 'revocations_expires_index' in result.output
+    assert 'posts_author_id_index' in db.list_indexes()
+    runner.invoke(args=['create-tables'])
+    db.refresh_tables()
+
+
+@microtest.test
+def test_create_tables_cmd(app, db):
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['create-tables'])
+    assert 'OK' in result.output
+    assert 'Created 0 missing tables' in result.output
+
+    db.drop_table('session_revocations')
+    result = runner.invoke(args=['create-tables'])
+    assert 'Created 1 missing tables' in result.output
+    assert 'session_revocations' in result.output
+    assert 'session_revocations' in db.list_tables()
+    db.refresh_tables()
+
+
 @microtest.test
 def test_create_user_cmd(app, db):
     runner = app.test_cli_runner()
@@ -43,3 +107,136 @@ def test_create_user_cmd(app, db):
     assert 'OK' in result.output
 
     assert db.get_table('users').get(username = 'user') is not None
+
+    result = runner.invoke(args=cmd)
+    assert 'Username user is already in use' in result.output
+
+    cmd[2] = 'other_user'
+    result = runner.invoke(args=cmd)
+    assert 'Email address test@mail.com is already in use' in result.output
+
+
+@microtest.test
+def test_sweep_expired_cmd(app, db):
+    import time
+    from flask_blog.common import Timestamp
+
+    runner = app.test_cli_runner()
+    users, sessions = db.get_table('users'), db.get_table('sessions')
+    otps, revocations = db.get_table('otps'), db.get_table('session_revocations')
+    expired = int(Timestamp(-1))
+    valid = int(Timestamp(1))
+
+    users.insert(username = 'user', email = 'test@mail.com', password = '')
+    user = users.get(username = 'user')
+
+    with db.transaction():
+        for i in range(5):
+            sessions.insert(session_id = bytes([i]), csrf_token = b'', expires = expired)
+            sessions.insert(session_id = bytes([i + 10]), csrf_token = b'', expires = valid)
+        otps.insert(value = b'1', expires = expired, type = 'test', user_id = user.id)
+        otps.insert(value = b'2', expires = valid, type = 'test', user_id = user.id)
+        revocations.insert(session_id = b'1', revoked = 0, expires = int(time.time()) - 60)
+        revocations.insert(session_id = b'2', revoked = 0, expires = int(time.time()) + 60)
+
+    result = runner.invoke(args=['sweep-expired', '--batch-size', '3', '--pause', '0'])
+    assert 'OK' in result.output
+    assert 'Deleted 7 expired rows' in result.output
+    assert 'sessions: 5 rows removed in 2 batches' in result.output
+
+    assert len(sessions.get_all()) == 5
+    assert all(Timestamp.load(row.expires) > Timestamp() for row in sessions.get_all())
+    assert [ row.value for row in otps.get_all() ] == [b'2']
+    assert [ row.session_id for row in revocations.get_all() ] == [b'2']
+
+    result = runner.invoke(args=['sweep-expired'])
+    assert 'Deleted 0 expired rows' in result.output
+
+    # Databases created before the session_revocations table was added.
+    db.drop_table('session_revocations')
+    result = runner.invoke(args=['sweep-expired'])
+    assert 'OK' in result.output
+    assert 'session_revocations' not in result.output
+    runner.invoke(args=['create-tables'])
+    db.refresh_tables()
+
+
+@microtest.test
+def test_migrate_timestamps_cmd(app, db):
+    from flask_blog.common import Timestamp
+    import flask_blog.schema as schema
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['migrate-timestamps'])
+    assert 'Migrated 0 tables' in result.output
+
+    expires = Timestamp(1)
+    db.drop_table('sessions')
+    db.create_table('sessions', dict(schema.sessions, expires = text(not_null = True)))
+    db.get_table('sessions').insert(session_id = b'1', csrf_token = b'', expires = str(expires))
+
+    result = runner.invoke(args=['sweep-expired'])
+    assert 'ERROR' in result.output
+    assert 'migrate-timestamps' in result.output
+
+    result = runner.invoke(args=['migrate-timestamps'])
+    assert 'OK' in result.output
+    assert 'sessions: 1 rows' in result.output
+
+    db.refresh_tables()
+    assert db.table_schema('sessions').columns['expires'] == 'INTEGER'
+    assert db.get_table('sessions').get(session_id = b'1').expires == int(expires)
+    assert 'sessions_session_id_index' in db.list_indexes()
+    assert 'sessions_expires_index' in db.list_indexes()
+
+
+@microtest.test
+def test_migrate_timestamps_from_old_schema():
+    import os
+    import tempfile
+    import flask_blog
+    import flask_blog.schema as schema
+    import flask_blog.orm as orm
+    from flask_blog.common import Timestamp
+
+    # The schema before the integer timestamps, the session_revocations table and the indexes.
+    old_schema = {
+        'users': schema.users,
+        'sessions': dict(schema.sessions, expires = text(not_null = True)),
+        'otps': dict(schema.otps, expires = text(not_null = True)),
+        'posts': dict(schema.posts, created = text(not_null = True)),
+        }
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'old.db')
+        database = orm.Database(path)
+        database.store_connection()
+        for name, table_schema in old_schema.items():
+            database.create_table(name, table_schema)
+        
+        created = Timestamp(-1)
+        database.get_table('users').insert(username = 'old', email = 'old@mail.com', password = '')
+        database.get_table('sessions').insert(session_id = b'1', csrf_token = b'', expires = str(created), user_id = 1)
+        database.get_table('otps').insert(value = b'1', expires = str(created), type = 'test', user_id = 1)
+        database.get_table('posts').insert(created = str(created), content = 'old', author_id = 1)
+        database.close_connection()
+
+        app = flask_blog.create_app({'TESTING': True, 'DATABASE': path, 'DATABASE_PRAGMA_PROFILE': 'default'})
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['migrate-timestamps'])
+        assert 'OK' in result.output
+        assert 'Migrated 3 tables' in result.output
+
+        database = orm.Database(path)
+        assert 'session_revocations' in database.list_tables()
+        assert 'revocations_expires_index' in database.list_indexes()
+        assert 'otps_value_unique_index' in database.list_indexes()
+        for table, column in (('sessions', 'expires'), ('otps', 'expires'), ('posts', 'created')):
+            assert database.table_schema(table).columns[column] == 'INTEGER'
+            assert getattr(database.get_table(table).get_all()[0], column) == int(created)
+
+        result = runner.invoke(args=['migrate-timestamps'])
+        assert 'Migrated 0 tables' in result.output
+
+        result = runner.invoke(args=['sweep-expired'])
+        assert 'Deleted 2 expired rows' in result.output
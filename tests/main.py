@@ -104,6 +104,8 @@ def create_test_app(database_path):
         'DATABASE':database_path,
         'EMAIL_HOST':(None, sys.stdout),
         'EMAIL_USE_SSL':False,
+        # WAL mode would leave -wal and -shm files next to the temporary database.
+        'DATABASE_PRAGMA_PROFILE':'default',
     }
     app = application.create_app(config)
 
@@ -11,3 +11,18 @@ def test_models(app):
         posts = models.posts
         assert isinstance(users, orm.Table)
         assert isinstance(posts, orm.Table)
+
+
+@microtest.test
+def test_query_stats(app):
+    client = app.test_client()
+    response = client.get('/auth/login')
+    assert 'X-Query-Count' not in response.headers
+
+    app.config['DATABASE_QUERY_STATS'] = True
+    try:
+        response = client.get('/auth/login')
+        assert int(response.headers['X-Query-Count']) > 0
+        assert response.headers['X-Query-Time'].endswith('ms')
+    finally:
+        app.config['DATABASE_QUERY_STATS'] = None
@@ -2,10 +2,14 @@ import microtest
 import tempfile
 import os
 import random
+import types
+import sqlite3
+import asyncio
 
 from flask_blog.orm import *
 from flask_blog.orm.sql import *
 from flask_blog.orm.sql.datatypes import *
+from flask_blog.orm.aio import AsyncDatabase
 
 
 fd = None
@@ -46,6 +50,17 @@ def test_table_creation():
     posts = db.create_table('posts', posts_schema)
 
 
+@microtest.test
+def test_index_creation():
+    index = Index('posts', ('user_id',))
+    db.create_index('posts_user_id', index)
+    db.create_index('posts_user_id', index)
+    assert db.list_indexes() == ['posts_user_id']
+    
+    db.create_index('users_bio', Index('users', ('bio',), where={'is_admin': 1}))
+    assert 'users_bio' in db.list_indexes()
+
+
 @microtest.test
 def test_loading_tables():
     db = Database(path)
@@ -85,6 +100,32 @@ def test_queries():
     assert len(matches) == 1
 
 
+@microtest.test
+def test_lookups():
+    users = db.get_table('users')
+    
+    matches = users.query(id__in=[1, 2, 3, 1000])
+    assert [ user.id for user in matches ] == [1, 2, 3]
+    assert users.query(id__in=[]) == []
+
+    assert len(users.query(id__between=(10, 19))) == 10
+    assert len(users.query(id__gt=95)) == 5
+    assert len(users.query(id__lt=5, bio__ne='hacker')) == len([ u for u in users.query(id__lt=5) if u.bio != 'hacker' ])
+    assert len(users.query(name__like='user9%')) == 10
+    assert len(users.query(bio__isnull=False)) == 100
+    assert users.get(bio__isnull=True) is None
+
+    assert microtest.raises(users.query, {'id__gt': 1, 'id': 2}, ValueError)
+
+    with users.update(id__ge=99) as results:
+        results.bio = 'last'
+    assert len(users.query(bio='last')) == 2
+
+    users.insert(name='lookup_test')
+    users.delete(bio__isnull=True)
+    assert users.get(name='lookup_test') is None
+
+
 @microtest.test
 def test_updates():
     users = db.get_table('users')
@@ -138,6 +179,448 @@ def test_deletions():
 
 
 
+@microtest.test
+def test_transactions():
+    posts = db.get_table('posts')
+    reader = Database(path)
+
+    with db.transaction():
+        posts.insert(content='first', created='Sunday')
+        posts.insert(content='second', created='Sunday')
+        assert len(posts.query(created='Sunday')) == 2
+        assert len(reader.get_table('posts').query(created='Sunday')) == 0
+    
+    assert len(reader.get_table('posts').query(created='Sunday')) == 2
+
+    def failing_transaction():
+        with db.transaction():
+            posts.delete(created='Sunday')
+            raise RuntimeError()
+
+    assert microtest.raises(failing_transaction, (), RuntimeError)
+    assert len(posts.query(created='Sunday')) == 2
+
+    with db.transaction():
+        posts.insert(content='third', created='Sunday')
+        try:
+            with db.transaction():
+                posts.delete(created='Sunday')
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+    
+    assert len(posts.query(created='Sunday')) == 3
+    assert not db.in_transaction
+    posts.delete()
+
+
+@microtest.test
+def test_bulk_inserts_and_iteration():
+    posts = db.get_table('posts')
+    posts.delete()
+
+    rows = ({'content': f'post{i}', 'created': 'Monday'} for i in range(25))
+    assert posts.insert_many(rows, chunk_size=10) == 25
+    assert len(posts.query(created='Monday')) == 25
+
+    rows = [ (f'post{i}', 'Tuesday') for i in range(5) ]
+    assert posts.insert_many(rows, columns=('content', 'created')) == 5
+    assert len(posts.query(created='Tuesday')) == 5
+
+    page = posts.query(created='Monday', order_by='-id', limit=10)
+    assert [ post.content for post in page ] == [ f'post{i}' for i in range(24, 14, -1) ]
+    
+    page = posts.query(created='Monday', order_by='-id', after=page[-1].id, limit=10)
+    assert [ post.content for post in page ] == [ f'post{i}' for i in range(14, 4, -1) ]
+
+    page = posts.query(order_by=('created', 'id'), limit=3)
+    assert [ post.content for post in page ] == ['post0', 'post1', 'post2']
+    page = posts.query(order_by=('created', 'id'), after=(page[-1].created, page[-1].id), limit=3)
+    assert [ post.content for post in page ] == ['post3', 'post4', 'post5']
+    page = posts.query(order_by=('created', 'id'), after=('Monday', 1000), limit=3)
+    assert [ (post.created, post.content) for post in page ] == [ ('Tuesday', f'post{i}') for i in range(3) ]
+    
+    invalid_keyset = lambda: posts.query(order_by=('created', 'id'), after=('Monday',))
+    assert microtest.raises(invalid_keyset, (), ValueError)
+
+    page = posts.query(order_by='id', limit=2, offset=3)
+    assert [ post.content for post in page ] == ['post3', 'post4']
+
+    posts_iter = posts.iter_query(batch_size=7, created='Monday')
+    assert isinstance(posts_iter, types.GeneratorType)
+    assert [ post.content for post in posts_iter ] == [ f'post{i}' for i in range(25) ]
+    assert len(list(posts.iter_all(batch_size=1))) == 30
+    assert microtest.raises(posts.iter_all, (0,), ValueError)
+
+    assert posts.insert_many([]) == 0
+    assert microtest.raises(posts.insert_many, (rows,), ValueError)
+    
+    invalid_rows = [{'content': 'post', 'created': 'Friday'}, {'content': 'post'}]
+    assert microtest.raises(posts.insert_many, (invalid_rows,), ValueError)
+    assert not posts.query(created='Friday')
+    posts.delete()
+
+
+@microtest.test
+def test_update_many():
+    posts = db.get_table('posts')
+    posts.insert_many([ ('post', 'Monday') for _ in range(5) ], columns=('content', 'created'))
+    ids = [ post.id for post in posts.query(content='post') ]
+
+    collector = QueryCollector()
+    db.observers.append(collector)
+    try:
+        changes = { post_id: {'content': 'updated'} for post_id in ids[:3] }
+        changes[ids[3]] = {'created': 'Friday', 'content': 'moved'}
+        changes[-1] = {'content': 'missing'}
+        assert posts.update_many(changes) == 4
+    finally:
+        db.observers.remove(collector)
+    
+    assert len(collector.queries) == 2
+    assert len(posts.query(content='updated')) == 3
+    assert posts.get(id=ids[3]).created == 'Friday'
+    assert posts.get(id=ids[4]).content == 'post'
+    assert posts.update_many({}) == 0
+
+    changes = { post_id: {'content': 'fails'} for post_id in ids }
+    assert microtest.raises(posts.update_many, (changes, 'no_such_column'), sqlite3.OperationalError)
+    assert posts.query(content='fails') == []
+
+    posts.delete(id__in=ids)
+
+
+@microtest.test
+def test_column_projection():
+    users = db.get_table('users')
+    users.insert(name='projected', bio='hidden')
+
+    user = users.get(columns=['id', 'name'], name='projected')
+    assert user._fields == ('id', 'name')
+    assert 'bio' not in user
+
+    names = users.query(columns=['name'], order_by='name', name__like='proj%')
+    assert [ row._asdict() for row in names ] == [{'name': 'projected'}]
+    assert all('bio' not in row for row in users.iter_all(columns=['id']))
+    assert microtest.raises(lambda: users.get(columns=['id; DROP TABLE users']), (), ValueError)
+
+    users.delete(name='projected')
+
+
+@microtest.test
+def test_joined_reads():
+    users = db.get_table('users')
+    posts = db.get_table('posts')
+    users.insert(name='author', bio='writes')
+    author = users.get(name='author')
+    posts.insert(content='joined', created='Monday', user_id=author.id)
+    posts.insert(content='orphan', created='Monday', user_id=-1)
+
+    collector = QueryCollector()
+    db.observers.append(collector)
+    try:
+        post, user = posts.get_with(users, on=('user_id', 'id'), content='joined')
+    finally:
+        db.observers.remove(collector)
+    
+    assert len(collector.queries) == 1
+    assert post.content == 'joined' and post.id != user.id
+    assert user._asdict() == author._asdict()
+
+    post, user = posts.get_with(users, ('user_id', 'id'), ['id'], ['name'], content='orphan')
+    assert post._fields == ('id',)
+    assert user is None
+    assert posts.get_with(users, ('user_id', 'id'), content='missing') is None
+
+    posts.delete(content__in=['joined', 'orphan'])
+    users.delete(name='author')
+
+
+@microtest.test
+def test_upserts():
+    users = db.get_table('users')
+    assert users.insert(name='upsert', bio='first')
+    assert not users.insert(or_ignore=True, name='upsert', bio='second')
+    assert microtest.raises(lambda: users.insert(name='upsert'), (), sqlite3.IntegrityError)
+
+    assert not users.upsert('name', name='upsert', bio='third')
+    assert users.get(name='upsert').bio == 'first'
+
+    assert users.upsert('name', on_conflict='update', name='upsert', bio='fourth')
+    assert users.get(name='upsert').bio == 'fourth'
+    assert len(users.query(name='upsert')) == 1
+
+    assert users.upsert(('name',), name='upserted', bio='new')
+    assert not users.upsert(None, name='upserted', bio='newer')
+    assert microtest.raises(lambda: users.upsert('name', on_conflict='replace', name='x'), (), ValueError)
+    assert microtest.raises(lambda: users.upsert('bio', bio='first'), (), sqlite3.OperationalError)
+
+    users.delete(name__in=['upsert', 'upserted'])
+
+
+@microtest.test
+def test_row_objects():
+    users = db.get_table('users')
+    users.insert(name='rowtest', bio='testing')
+    users.insert(name='rowtest2', bio='testing')
+    
+    first, second = users.get_all()[:2]
+    assert type(first) is type(second)
+    assert isinstance(first, Row)
+    assert isinstance(first, Namespace)
+    assert 'bio' in first
+    assert 'password' not in first
+    assert microtest.raises(lambda: first.password, (), AttributeError)
+
+    user = users.get(name='rowtest')
+    user.is_admin += 1
+    assert user.is_admin == 1
+    assert user._asdict()['bio'] == 'testing'
+    assert not hasattr(user, '__dict__')
+    assert microtest.raises(setattr, (user, 'extra', 'value'), AttributeError)
+
+    cursor = db.conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM users')
+    assert isinstance(cursor.fetchone(), Namespace)
+
+
+@microtest.test
+def test_connection_pool():
+    pool = ConnectionPool(path, max_size=1, timeout=0.01)
+    try:
+        pooled_db = Database(path, pool)
+        pooled_db.store_connection()
+        conn = pooled_db.conn
+        assert microtest.raises(pool.acquire, (), TimeoutError)
+
+        pooled_db.close_connection()
+        assert pool.acquire() is conn
+        pool.release(conn)
+
+        assert isinstance(pooled_db.get_table('users').get_all(), list)
+        assert pool.size == 1
+    
+    finally:
+        pool.close()
+    
+    assert pool.size == 0
+    assert microtest.raises(pool.acquire, (), ValueError)
+
+
+@microtest.test
+def test_query_collector():
+    collector = QueryCollector(repeat_threshold=2)
+    db.observers.append(collector)
+    try:
+        posts = db.get_table('posts')
+        posts.insert(content='collected', created='Thursday')
+        for _ in range(3):
+            posts.get(content='collected')
+        posts.query(created='Thursday')
+        posts.insert_many([('a', 'Thursday'), ('b', 'Thursday')], columns=('content', 'created'))
+        posts.delete(created='Thursday')
+    finally:
+        db.observers.remove(collector)
+
+    statements = [ query[0] for query in collector.queries ]
+    assert statements[0] == 'INSERT INTO posts (content, created) VALUES (?, ?)'
+    assert len(statements) == 7
+    
+    assert collector.queries[1][1:3] == (1, 1)
+    assert collector.queries[5][1:3] == (4, 2)
+    assert collector.queries[6][2] == 3
+    assert collector.repeated() == [('SELECT * FROM posts WHERE content = ?', 3)]
+    assert collector.summary().startswith('7 queries, 10 rows')
+
+
+@microtest.test
+def test_schema_cache():
+    cache = SchemaCache()
+    cached_db = Database(path, schema_cache=cache)
+    assert cache.loads == 1
+
+    other_db = Database(path, schema_cache=cache)
+    assert cache.loads == 1
+    assert set(other_db.tables) == set(cached_db.tables)
+
+    posts = other_db.get_table('posts')
+    assert posts.columns['content'] == 'TEXT'
+    assert 'id' in posts.columns
+    assert 'posts_user_id' in other_db.table_schema('posts').indexes
+
+    db.conn.execute('CREATE TABLE created_elsewhere (id INTEGER)')
+    db.conn.commit()
+    try:
+        assert 'created_elsewhere' in Database(path, schema_cache=cache).tables
+        assert cache.loads == 2
+
+        assert 'created_elsewhere' not in other_db.tables
+        assert other_db.get_table('created_elsewhere') is not None
+        assert cache.loads == 2
+
+        other_db.refresh_tables()
+        assert cache.loads == 2
+
+        other_db.drop_table('created_elsewhere')
+        assert cache.entries == {}
+    finally:
+        db.conn.execute('DROP TABLE IF EXISTS created_elsewhere')
+        db.conn.commit()
+
+    assert microtest.raises(other_db.get_table, ('no_such_table',), AttributeError)
+
+
+@microtest.test
+def test_async_database():
+    async def run():
+        async with AsyncDatabase(path) as database:
+            posts = database.posts
+            await posts.insert(content='async', created='Sunday')
+            await asyncio.gather(
+                posts.insert(content='async', created='Monday'),
+                posts.insert(content='async', created='Tuesday'),
+                )
+            assert len(await posts.query(content='async')) == 3
+
+            async with posts.update(created='Sunday') as post:
+                post.content = 'updated'
+            assert (await posts.get(created='Sunday')).content == 'updated'
+
+            try:
+                async with database.transaction():
+                    await posts.delete(content='async')
+                    raise RuntimeError()
+            except RuntimeError:
+                pass
+            assert len(await posts.query(content='async')) == 2
+            
+            await posts.delete(created__in=['Sunday', 'Monday', 'Tuesday'])
+            return await posts.get_all()
+
+    assert asyncio.run(run()) == db.get_table('posts').get_all()
+
+    async def reconnect():
+        database = AsyncDatabase(path, schema_cache=SchemaCache())
+        await database.connect()
+        await database.close()
+        await database.connect()
+        try:
+            # Created after the table list was loaded, found with a refresh on the executor thread.
+            await database.run(database.database.conn.execute, 'CREATE TABLE async_tags (name TEXT)')
+            await database.async_tags.insert(name='async')
+            return await database.async_tags.get_all()
+        finally:
+            await database.run(database.database.conn.execute, 'DROP TABLE async_tags')
+            await database.close()
+
+    assert [ row.name for row in asyncio.run(reconnect()) ] == ['async']
+
+
+@microtest.test
+def test_slow_query_log():
+    log_path = os.path.join(tempfile.gettempdir(), 'flask-blog-slow-queries.log')
+    slow_queries = SlowQueryLog(log_path, threshold=0.0)
+    db.observers.append(slow_queries)
+    try:
+        posts = db.get_table('posts')
+        posts.insert(content='slow', created='Friday')
+        posts.query(id__in=[1, 2, 3], content='slow')
+    finally:
+        db.observers.remove(slow_queries)
+        slow_queries.close()
+
+    with open(log_path) as file:
+        entries = file.read()
+    os.remove(log_path)
+
+    assert 'SELECT * FROM posts WHERE id IN (...) AND content = ?' in entries
+    assert 'QUERY PLAN' in entries
+    assert 'orm_tests.py' in entries
+    assert normalize_statement('SELECT *\n  FROM t WHERE id IN (?, ?)') == 'SELECT * FROM t WHERE id IN (...)'
+
+    posts.delete(content='slow')
+
+
+@microtest.test
+def test_read_write_routing():
+    read_pool = ConnectionPool(path, max_size=2, readonly=True)
+    routed_db = Database(path, read_pool=read_pool)
+    posts = routed_db.get_table('posts')
+    try:
+        posts.insert(content='routed', created='Saturday')
+        assert posts.get(content='routed') is not None
+        assert routed_db.reader is not None
+        assert routed_db.conn is None
+
+        write = lambda: routed_db.reader.execute('DELETE FROM posts')
+        assert microtest.raises(write, (), sqlite3.OperationalError)
+
+        reader = routed_db.reader
+        with routed_db.transaction():
+            posts.delete(content='routed')
+            assert posts.get(content='routed') is None
+            assert db.get_table('posts').get(content='routed') is not None
+        
+        # An iterator may still be reading from the reader, only the writer is released.
+        assert routed_db.reader is reader
+        assert routed_db.conn is None
+        posts.insert_many([ dict(content='routed', created='Sunday') ])
+        assert routed_db.reader is reader
+        assert routed_db.conn is None
+        posts.delete(content='routed')
+        
+        posts.insert(content='routed', created='Saturday')
+        routed_db.read_your_writes = True
+        with routed_db.connection(readonly=True) as conn:
+            assert conn is not routed_db.reader
+        
+        routed_db.close_connection()
+        assert routed_db.reader is None
+        assert read_pool.size == 1 and len(read_pool.idle) == 1
+        posts.delete()
+    
+    finally:
+        routed_db.close_connection()
+        read_pool.close()
+
+
+@microtest.test
+def test_pragma_profiles():
+    pragmas = get_pragma_profile('performance')
+    pragmas['cache_size'] = -1000
+
+    pragma_db = Database(path, pragmas=pragmas)
+    pragma_db.store_connection()
+    try:
+        cursor = pragma_db.conn.cursor()
+        assert cursor.execute('PRAGMA journal_mode').fetchone().journal_mode == 'wal'
+        assert cursor.execute('PRAGMA cache_size').fetchone().cache_size == -1000
+        assert cursor.execute('PRAGMA temp_store').fetchone().temp_store == 2
+    finally:
+        pragma_db.close_connection()
+
+    assert microtest.raises(get_pragma_profile, ('fastest',), ValueError)
+
+
+@microtest.test
+def test_rebuild_table():
+    events = db.create_table('events', {'id': integer(primary_key=True), 'created': text(), 'name': text()})
+    events.insert_many([(1, '100', 'a'), (2, '200', 'b')], columns=('id', 'created', 'name'))
+    db.create_index('events_created', Index('events', ('created',)))
+
+    schema = {'id': integer(primary_key=True), 'created': integer(not_null=True), 'name': text(), 'flag': integer(default=1)}
+    assert db.rebuild_table('events', schema, convert={'created': int}, chunk_size=1) == 2
+    assert db.table_schema('events').columns['created'] == 'INTEGER'
+    assert 'events_created' not in db.list_indexes()
+    assert 'events_rebuild' not in db.list_tables()
+
+    rows = db.get_table('events').get_all()
+    assert [ (row.id, row.created, row.name, row.flag) for row in rows ] == [(1, 100, 'a', 1), (2, 200, 'b', 1)]
+
+    assert microtest.raises(db.rebuild_table, ('missing', schema), ValueError)
+    db.drop_table('events')
+
+
 @microtest.test
 def test_drop_table():
     users = db.get_table('users')
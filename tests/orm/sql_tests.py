@@ -11,6 +11,40 @@ def test_insert():
     result = sql.insert('users', ('id', 'password', 'username'))
     assert result.lower() == 'insert into users (id, password, username) values (?, ?, ?)'
 
+    result = sql.insert('tests', ('data',), or_ignore=True)
+    assert result.lower() == 'insert or ignore into tests (data) values (?)'
+
+
+@microtest.test
+def test_select_join():
+    result = sql.select_join('sessions', ('session_id',), 'users', ('id', 'username'), ('user_id', 'id'), session_id=sql.EQ)
+    expected = 'select sessions.session_id, users.id, users.username from sessions '
+    expected += 'left join users on sessions.user_id = users.id where sessions.session_id = ?'
+    assert result.lower() == expected
+
+    assert microtest.raises(sql.select_join, ('sessions', ('id',), 'users; --', ('id',), ('user_id', 'id')), ValueError)
+    assert microtest.raises(sql.select_join, ('sessions', ('id',), 'users', ('id',), ('user_id', '1 = 1')), ValueError)
+    assert microtest.raises(sql.select_join, ('sessions', (), 'users', ('id',), ('user_id', 'id')), ValueError)
+
+
+@microtest.test
+def test_upsert():
+    result = sql.upsert('users', ('username', 'email'), ('username',))
+    assert result.lower() == 'insert into users (username, email) values (?, ?) on conflict (username) do nothing'
+
+    result = sql.upsert('users', ('username', 'email', 'bio'), ('username',), update=('email', 'bio'))
+    expected = 'insert into users (username, email, bio) values (?, ?, ?) on conflict (username) '
+    expected += 'do update set email = excluded.email, bio = excluded.bio'
+    assert result.lower() == expected
+
+    result = sql.upsert('users', ('username', 'email'), None)
+    assert result.lower() == 'insert into users (username, email) values (?, ?) on conflict do nothing'
+
+    assert microtest.raises(sql.upsert, ('users', ('username',), ()), ValueError)
+    assert microtest.raises(lambda: sql.upsert('users', ('username',), None, update=('username',)), (), ValueError)
+    assert microtest.raises(sql.upsert, ('users', ('username',), ('username; DROP TABLE users',)), ValueError)
+    assert microtest.raises(lambda: sql.upsert('users', ('username',), ('username',), update=('1 = 1',)), (), ValueError)
+
 
 @microtest.test
 def test_select():
@@ -21,13 +55,33 @@ def test_select():
     assert result.lower() == 'select * from users where id = ?'
 
     result = sql.select('users', ('id', 'username'))
-    assert result.lower() == 'select (id, username) from users'
+    assert result.lower() == 'select id, username from users'
 
     result = sql.select('users', ('username',), id=sql.EQ)
-    assert result.lower() == 'select (username) from users where id = ?'
+    assert result.lower() == 'select username from users where id = ?'
 
     result = sql.select('users', ('bio',), id=sql.EQ, username=sql.EQ)
-    assert result.lower() == 'select (bio) from users where id = ? and username = ?'
+    assert result.lower() == 'select bio from users where id = ? and username = ?'
+
+    result = sql.select('posts', order_by=('-created', 'id'), limit=True, offset=True)
+    assert result.lower() == 'select * from posts order by created desc, id limit ? offset ?'
+
+    result = sql.select('posts', order_by=('-id',), after=True, limit=True, author_id=sql.EQ)
+    assert result.lower() == 'select * from posts where author_id = ? and id < ? order by id desc limit ?'
+
+    result = sql.select('posts', order_by=('id',), after=True, offset=True)
+    assert result.lower() == 'select * from posts where id > ? order by id limit -1 offset ?'
+
+    result = sql.select('posts', order_by=('-created', '-id'), after=True, limit=True)
+    assert result.lower() == 'select * from posts where (created, id) < (?, ?) order by created desc, id desc limit ?'
+
+    invalid_keyset = lambda: sql.select('posts', after=True)
+    mixed_keyset = lambda: sql.select('posts', order_by=('-created', 'id'), after=True)
+    invalid_ordering = lambda: sql.select('posts', order_by=('-; DROP TABLE posts',))
+    
+    assert microtest.raises(invalid_keyset, (), ValueError)
+    assert microtest.raises(mixed_keyset, (), ValueError)
+    assert microtest.raises(invalid_ordering, (), ValueError)
 
     invalid_param = lambda: sql.select('users', ('username',), name='; DROP TABLE users')
     invalid_query = lambda: sql.select('users', ('username',), **{'; DROP TABLE users':sql.EQ})
@@ -75,6 +129,26 @@ def test_delete():
     assert microtest.raises(invalid_query, (), ValueError)
 
 
+@microtest.test
+def test_operators():
+    result = sql.select('users', id=sql.NE, name=sql.LIKE, age=sql.GE)
+    assert result.lower() == 'select * from users where id != ? and name like ? and age >= ?'
+
+    result = sql.select('users', id=(sql.IN, 3), created=sql.BETWEEN)
+    assert result.lower() == 'select * from users where id in (?, ?, ?) and created between ? and ?'
+
+    result = sql.update('users', ('bio',), bio=sql.IS_NULL)
+    assert result.lower() == 'update users set bio = ? where bio is null'
+
+    result = sql.delete('sessions', expires=sql.LT, user_id=sql.IS_NOT_NULL)
+    assert result.lower() == 'delete from sessions where expires < ? and user_id is not null'
+
+    invalid_operators = [sql.IN, (sql.EQ, 2), (sql.IN, -1), (sql.IN, '1); DROP TABLE users')]
+    for operator in invalid_operators:
+        invalid_query = lambda: sql.select('users', id=operator)
+        assert microtest.raises(invalid_query, (), ValueError)
+
+
 @microtest.test
 def test_datatypes():
     dt = sql_datatypes.integer()
@@ -120,6 +194,34 @@ def test_creating_tables():
     assert result.lower() == 'create table posts (id integer primary key autoincrement, user_id integer, foreign key(user_id) references users(id), content text)'
 
 
+@microtest.test
+def test_creating_indexes():
+    index = sql_datatypes.index('sessions', 'session_id', unique=True)
+    result = sql.create_index('sessions_index', index)
+    assert result.lower() == 'create unique index if not exists sessions_index on sessions (session_id)'
+
+    index = sql_datatypes.index('otps', 'user_id', 'type', where={'type': 'email_token', 'user_id': 1, 'value': None})
+    result = sql.create_index('otps_index', index)
+    assert result.lower() == "create index if not exists otps_index on otps (user_id, type) where type = 'email_token' and user_id = 1 and value is null"
+
+    assert microtest.raises(sql_datatypes.index, ('posts',), ValueError)
+    assert microtest.raises(sql_datatypes.index, ('posts', '; DROP TABLE posts'), ValueError)
+    assert microtest.raises(sql.create_index, ('; DROP TABLE posts', index), ValueError)
+
+    make_index = lambda: sql_datatypes.index('otps', 'type', where={'type': "'; DROP TABLE otps"}).resolve()
+    assert microtest.raises(make_index, (), ValueError)
+
+
+@microtest.test
+def test_pragmas():
+    assert sql.pragma('journal_mode', 'WAL') == 'PRAGMA journal_mode = WAL'
+    assert sql.pragma('cache_size', -2000) == 'PRAGMA cache_size = -2000'
+
+    assert microtest.raises(sql.pragma, ('; DROP TABLE users', 1), ValueError)
+    assert microtest.raises(sql.pragma, ('journal_mode', 'WAL; DROP TABLE users'), ValueError)
+    assert microtest.raises(sql.pragma, ('cache_size', 1.5), ValueError)
+
+
 @microtest.test
 def test_dropping_tables():
     result = sql.drop_table('users')
@@ -151,4 +253,33 @@ def test_name_validation():
         'sqlite_users',
     ]
     for name in invalid_names:
-        assert not sql.valid_name(name), (f'Invalid name {name} passed validation',)
\ No newline at end of file
+        assert not sql.valid_name(name), (f'Invalid name {name} passed validation',)
+
+@microtest.test
+def test_statement_cache():
+    cache = sql.StatementCache(max_size=2)
+
+    result = cache.get(sql.select, 'users', None, id=sql.EQ)
+    assert result == sql.select('users', None, id=sql.EQ)
+    assert cache.get(sql.select, 'users', None, id=sql.EQ) is result
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.get(sql.select, 'users', None, username=sql.EQ)
+    cache.get(sql.insert, 'users', ['username'])
+    assert len(cache) == 2
+    
+    cache.get(sql.select, 'users', None, id=sql.EQ)
+    assert (cache.hits, cache.misses) == (1, 4)
+
+    # Column lists and tuples share the same entry.
+    assert cache.get(sql.insert, 'users', ('username',)) == sql.insert('users', ['username'])
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert cache.get(sql.upsert, 'users', ['bio'], ['bio'], update=['bio']) == sql.upsert('users', ['bio'], ['bio'], update=['bio'])
+    assert cache.get(sql.upsert, 'users', ['bio'], ['bio'], update=['bio']) is not None
+    assert (cache.hits, cache.misses) == (3, 5)
+
+    invalid_query = lambda: cache.get(sql.delete, 'users', **{'; DROP TABLE users':sql.EQ})
+    assert microtest.raises(invalid_query, (), ValueError)
+    assert len(cache) == 2
+
+    assert sql.cached(sql.update, 'users', ('bio',), id=sql.EQ) == 'UPDATE users SET bio = ? WHERE id = ?'
@@ -41,7 +41,7 @@ def test_valid_unlock_token(app, db):
         otps_table = db.get_table('otps')
         users_table = db.get_table('users')
         
-        otps_table.insert(value=unlock_token, expires=str(Timestamp(1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
+        otps_table.insert(value=unlock_token, expires=int(Timestamp(1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
         form =  {
             'unlock_token': unlock_token.hex(),
             'csrf_token': session.csrf_token.hex(),
@@ -62,7 +62,7 @@ def test_expired_unlock_token(app, db):
         otps_table = db.get_table('otps')
         users_table = db.get_table('users')
 
-        otps_table.insert(value=unlock_token, expires=str(Timestamp(-1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
+        otps_table.insert(value=unlock_token, expires=int(Timestamp(-1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
         form =  {
             'unlock_token': unlock_token.hex(),
             'csrf_token': session.csrf_token.hex(),
@@ -83,7 +83,7 @@ def test_invalid_unlock_token(app, db):
         otps_table = db.get_table('otps')
         users_table = db.get_table('users')
 
-        otps_table.insert(value=unlock_token, expires=str(Timestamp(1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
+        otps_table.insert(value=unlock_token, expires=int(Timestamp(1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
         form =  {
             'unlock_token': '123',
             'csrf_token': session.csrf_token.hex(),
@@ -104,7 +104,7 @@ def test_invalid_csrf_token(app, db):
         otps_table = db.get_table('otps')
         users_table = db.get_table('users')
 
-        otps_table.insert(value=unlock_token, expires=str(Timestamp(1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
+        otps_table.insert(value=unlock_token, expires=int(Timestamp(1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
         form =  {
             'unlock_token': unlock_token.hex(),
             'csrf_token': '123',
@@ -125,7 +125,7 @@ def test_invalid_username(app, db):
         otps_table = db.get_table('otps')
         users_table = db.get_table('users')
         
-        otps_table.insert(value=unlock_token, expires=str(Timestamp(1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
+        otps_table.insert(value=unlock_token, expires=int(Timestamp(1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
         form =  {
             'unlock_token': unlock_token.hex(),
             'csrf_token': session.csrf_token.hex(),
@@ -146,7 +146,7 @@ def test_missing_values(app, db):
         otps_table = db.get_table('otps')
         users_table = db.get_table('users')
         
-        otps_table.insert(value=unlock_token, expires=str(Timestamp(1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
+        otps_table.insert(value=unlock_token, expires=int(Timestamp(1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
         form = {
             'unlock_token': '',
             'csrf_token': '',
@@ -167,7 +167,7 @@ def test_empty_form(app, db):
         otps_table = db.get_table('otps')
         users_table = db.get_table('users')
         
-        otps_table.insert(value=unlock_token, expires=str(Timestamp(1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
+        otps_table.insert(value=unlock_token, expires=int(Timestamp(1)), user_id=user_id, type=auth.OTP.ACCOUNT_LOCK)
         form =  {}
 
         err = auth.unlock_user_account(form, session)
@@ -1,4 +1,5 @@
 import microtest
+import sqlite3
 import flask
 import flask_blog.security as security
 import flask_blog.security.auth as auth
@@ -38,8 +39,8 @@ def test_user_login(app, db):
 
             assert flask.session[auth.SESSIONID] != session_id
             assert isinstance(session.csrf_token, bytes)
-            assert isinstance(session.expires, str)
-            assert Timestamp.from_str(session.expires) is not None
+            assert isinstance(session.expires, int)
+            assert Timestamp.load(session.expires) is not None
             assert 'user' in flask.g
             assert sessions_table.get(user_id = 0) is None
 
@@ -102,7 +103,16 @@ def test_creating_email_tokens(app, db):
         otp = db.get_table('otps').get(user_id = userid)
         assert otp is not None
         assert otp.value == token
-        assert otp.expires == str(expires)
+        assert otp.expires == int(expires)
+
+        # NOT NULL violations are raised, not retried.
+        assert microtest.raises(auth.generate_otp, (None, auth.OTP.EMAIL, lifetime), sqlite3.IntegrityError)
+
+        # Databases created before the unique index was added.
+        db.conn.execute('DROP INDEX otps_value_unique_index')
+        db.conn.commit()
+        token, expires = auth.generate_otp(userid, auth.OTP.EMAIL, lifetime)
+        assert db.get_table('otps').get(value = token) is not None
 
 
 @microtest.group('slow')
@@ -128,7 +138,7 @@ def test_login_attempt_recording(app, db):
                     user_id = user.id,
                     type = auth.OTP.ACCOUNT_LOCK,
                     value = b'\x00\x01',
-                    expires = str(Timestamp(1))
+                    expires = int(Timestamp(1))
                     )
 
                 user, maxed_out = auth.record_login_attempt(form)
@@ -32,7 +32,7 @@ def test_valid_email_token(app, db):
     with app.app_context():
         db.get_table('otps').insert(
             value=email_token,
-            expires=str(Timestamp(1)),
+            expires=int(Timestamp(1)),
             user_id=user_id,
             type=auth.OTP.EMAIL
             )
@@ -49,7 +49,7 @@ def test_valid_email_token(app, db):
 @microtest.test
 def test_invalid_token(app, db):
     with app.app_context():
-        db.get_table('otps').insert(value=email_token, expires=str(Timestamp(1)), user_id=user_id, type=auth.OTP.EMAIL)
+        db.get_table('otps').insert(value=email_token, expires=int(Timestamp(1)), user_id=user_id, type=auth.OTP.EMAIL)
         form =  {
             'verification_token': '123',
             'csrf_token': session.csrf_token.hex()
@@ -63,7 +63,7 @@ def test_invalid_token(app, db):
 @microtest.test
 def test_non_existing_csrf_token(app, db):
     with app.app_context():
-        db.get_table('otps').insert(value=email_token, expires=str(Timestamp(1)), user_id=user_id, type=auth.OTP.EMAIL)
+        db.get_table('otps').insert(value=email_token, expires=int(Timestamp(1)), user_id=user_id, type=auth.OTP.EMAIL)
         form =  {'verification_token': email_token.hex()}
 
         err = auth.validate_email_verification(form, session)
@@ -74,7 +74,7 @@ def test_non_existing_csrf_token(app, db):
 @microtest.test
 def test_expired_token(app, db):
     with app.app_context():
-        db.get_table('otps').insert(value=email_token, expires=str(Timestamp(-1)), user_id=user_id, type=auth.OTP.EMAIL)
+        db.get_table('otps').insert(value=email_token, expires=int(Timestamp(-1)), user_id=user_id, type=auth.OTP.EMAIL)
 
         form =  {
             'verification_token': email_token.hex(),
@@ -23,7 +23,7 @@ anon_session = Session(
 auth_session = Session(
     session_id = b'\x00\x02',
     csrf_token = b'\x00\x0b',
-    expires = str(Timestamp(1)),
+    expires = int(Timestamp(1)),
     user_id = 1
     )
     
@@ -42,7 +42,7 @@ def reset(app, db):
         db.get_table('otps').insert(
             user_id = 1,
             value = reset_token,
-            expires = str(Timestamp(1)),
+            expires = int(Timestamp(1)),
             type = auth.OTP.PASSWORD_RESET,
             )
 
@@ -208,7 +208,7 @@ def test_password_reset_anon_user_no_otp(app, db):
 def test_password_reset_anon_invalid_new_password(app, db):
     with app.app_context():
         with db.get_table('otps').update(user_id = 1, type = auth.OTP.PASSWORD_RESET) as otp:
-            otp.expires = str(Timestamp(-1))
+            otp.expires = int(Timestamp(-1))
         
         form =  {
             'username': username,
@@ -227,7 +227,7 @@ def test_password_reset_anon_invalid_new_password(app, db):
 def test_password_reset_anon_passwords_dont_match(app, db):
     with app.app_context():
         with db.get_table('otps').update(user_id = 1, type = auth.OTP.PASSWORD_RESET) as otp:
-            otp.expires = str(Timestamp(-1))
+            otp.expires = int(Timestamp(-1))
         
         form =  {
             'username': username,
@@ -246,7 +246,7 @@ def test_password_reset_anon_passwords_dont_match(app, db):
 def test_password_reset_anon_expired_otp(app, db):
     with app.app_context():
         with db.get_table('otps').update(user_id = 1, type = auth.OTP.PASSWORD_RESET) as otp:
-            otp.expires = str(Timestamp(-1))
+            otp.expires = int(Timestamp(-1))
         
         form =  {
             'username': username,
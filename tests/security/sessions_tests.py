@@ -1,8 +1,10 @@
 import microtest
 import flask
+import time
 from flask_blog.security import *
 import flask_blog.security.sessions as sessions
 from flask_blog.common import Timestamp
+import flask_blog.schema as schema
 
 
 username = 'testing_sessions_and_auth'
@@ -37,6 +39,16 @@ def test_timestamps(app, db):
     assert Timestamp() < Timestamp(10)
     assert Timestamp(10) > Timestamp()
 
+    ts5 = Timestamp.load(int(ts3))
+    assert ts5 == ts3
+    assert Timestamp.load(str(int(ts3))) == ts3
+    assert Timestamp.load(str(ts3)) == ts3
+
+    class LocalTimestamp(Timestamp):
+        pass
+    assert type(LocalTimestamp.load(int(ts3))) is LocalTimestamp
+    assert type(LocalTimestamp.load(str(ts3))) is LocalTimestamp
+
 
 @microtest.group('slow')
 @microtest.test
@@ -63,6 +75,38 @@ def test_creating_sessions(app, db):
         assert Timestamp() < session.expires
         assert not session.is_expired
 
+        # Databases created before the unique index was added.
+        db.conn.execute('DROP INDEX sessions_session_id_index')
+        db.conn.commit()
+        session = sessions.create_new_session()
+        assert sessions_table.get(session_id = session.id) is not None
+
+
+@microtest.test
+def test_csrf_token_strategies(app, db):
+    session_id = b'\x01' * sessions.SESSIONID_RAND_BYTES
+    secret_key = b'secret'
+    
+    token = sessions.hmac_csrf_token(session_id, secret_key)
+    assert token == sessions.hmac_csrf_token(session_id, secret_key)
+    assert token != sessions.hmac_csrf_token(session_id, b'other secret')
+    assert len(sessions.random_csrf_token(session_id, secret_key)) == sessions.CSRF_TOKEN_BYTES
+
+    with app.app_context():
+        default = app.config['CSRF_TOKEN_STRATEGY']
+        try:
+            app.config['CSRF_TOKEN_STRATEGY'] = lambda session_id, secret_key: b'custom'
+            assert sessions.create_new_session().csrf_token == b'custom'
+
+            app.config['CSRF_TOKEN_STRATEGY'] = 'unknown'
+            assert microtest.raises(sessions.create_new_session, (), ValueError)
+        
+        finally:
+            app.config['CSRF_TOKEN_STRATEGY'] = default
+        
+        session = sessions.create_new_session()
+        assert session.csrf_token == sessions.hmac_csrf_token(session.id, app.config['SECRET_KEY'].encode())
+
 
 @microtest.group('slow')
 @microtest.test
@@ -76,7 +120,7 @@ def test_loading_sessions(app, db):
         sessions_table.insert(
             session_id = session_id,
             csrf_token = csrf_token,
-            expires = str(Timestamp(1)),
+            expires = int(Timestamp(1)),
             user_id = userid
             )
 
@@ -89,23 +133,30 @@ def test_loading_sessions(app, db):
 
         session = sessions.load_user_session(None)
 
-        assert len(sessions_table.get_all()) == 1
+        assert len(sessions_table.get_all()) == 0
         assert session.is_anonymous
+        assert not session.is_stored
+
+        session.csrf_token
+        assert session.is_stored
+        assert len(sessions_table.get_all()) == 1
+        assert sessions.load_user_session(session.id.hex()).id == session.id
 
         sessions_table.delete()
 
         session = sessions.load_user_session('100')
 
-        assert len(sessions_table.get_all()) == 1
+        assert len(sessions_table.get_all()) == 0
         assert session.is_anonymous
 
         sessions_table.delete()
         sessions_table.insert(
             session_id = session_id,
             csrf_token = csrf_token,
-            expires = str(Timestamp(-1)),
+            expires = int(Timestamp(-1)),
             user_id = userid
             )
+        sessions.get_session_cache().clear()
 
         session = sessions.load_user_session(session_id.hex())
         
@@ -113,6 +164,169 @@ def test_loading_sessions(app, db):
         assert session.is_anonymous
 
 
+@microtest.test
+def test_session_cache(app, db):
+    with app.app_context():
+        sessions_table = db.get_table('sessions')
+        cache = sessions.get_session_cache()
+        cache.clear()
+        
+        session = sessions.create_new_session(1)
+        stats = cache.stats()
+        assert sessions.load_user_session(session.id.hex()).id == session.id
+        assert sessions.load_user_session(session.id.hex()).id == session.id
+        assert cache.stats()['misses'] == stats['misses'] + 1
+        assert cache.stats()['hits'] == stats['hits'] + 1
+
+        unknown = (2).to_bytes(sessions.SESSIONID_RAND_BYTES, 'big').hex()
+        assert sessions.load_user_session(unknown).is_anonymous
+        assert sessions.load_user_session(unknown).is_anonymous
+        assert cache.stats()['negative_hits'] == stats['negative_hits'] + 1
+        assert cache.stats()['size'] == 2
+
+        sessions.end_session(session.id)
+        assert sessions.load_user_session(session.id.hex()).is_anonymous
+
+        other = sessions.create_new_session(3)
+        sessions.load_user_session(other.id.hex())
+        sessions.end_user_sessions(3)
+        assert sessions.load_user_session(other.id.hex()).is_anonymous
+
+        small_cache = sessions.SessionCache(max_size=2)
+        for i in range(3):
+            small_cache.put(bytes([i]), None)
+        assert small_cache.get(bytes([0])) == (False, None)
+        assert small_cache.get(bytes([2])) == (True, None)
+
+        # The cache of another process sees the revocations when its revocation list is reloaded.
+        other_process = sessions.SessionCache(revocations=sessions.RevocationList(ttl=0))
+        session = sessions.create_new_session(4)
+        other_process.put(session.id, session)
+        assert other_process.get(session.id) == (True, session)
+        sessions.end_session(session.id)
+        assert other_process.get(session.id) == (False, None)
+
+        session = sessions.create_new_session(5)
+        other_process.put(session.id, session)
+        time.sleep(0.002)
+        sessions.end_user_sessions(5)
+        assert other_process.get(session.id) == (False, None)
+
+
+@microtest.test
+def test_session_cache_without_revocations_table(app, db):
+    # Databases created before the session_revocations table was added.
+    db.drop_table('session_revocations')
+    try:
+        with app.app_context():
+            other_process = sessions.SessionCache(revocations=sessions.RevocationList(ttl=0))
+            session = sessions.create_new_session(6)
+            other_process.put(session.id, session)
+            assert other_process.get(session.id) == (True, session)
+
+            sessions.end_session(session.id)
+            assert sessions.load_user_session(session.id.hex()).is_anonymous
+            sessions.end_user_sessions(6)
+
+            app.config['SESSION_BACKEND'] = 'signed'
+            try:
+                assert microtest.raises(sessions.end_session, (session.id,), AttributeError)
+            finally:
+                app.config['SESSION_BACKEND'] = 'database'
+    finally:
+        db.create_table('session_revocations', schema.session_revocations)
+
+
+@microtest.test
+def test_loading_session_and_user(app, db):
+    with app.app_context():
+        users_table = db.get_table('users')
+        users_table.insert(username='joined', email='joined@mail.com', password='')
+        user = users_table.get(username='joined')
+        sessions.get_session_cache().clear()
+
+        session = sessions.create_new_session(user.id)
+        loaded, loaded_user = sessions.load_session_and_user(session.id.hex())
+        assert loaded.id == session.id
+        assert loaded_user.username == 'joined'
+
+        hits = sessions.get_session_cache().stats()['hits']
+        loaded, loaded_user = sessions.load_session_and_user(session.id.hex())
+        assert loaded_user.id == user.id
+        assert sessions.get_session_cache().stats()['hits'] == hits + 1
+
+        anonymous = sessions.create_new_session()
+        assert sessions.load_session_and_user(anonymous.id.hex())[1] is None
+        
+        session, user = sessions.load_session_and_user('garbage')
+        assert session.is_anonymous and user is None
+
+        deleted = sessions.create_new_session(loaded_user.id)
+        assert sessions.load_session_and_user(deleted.id.hex())[1] is not None
+        users_table.delete(id = loaded_user.id)
+        loaded, loaded_user = sessions.load_session_and_user(deleted.id.hex())
+        assert loaded.is_anonymous and not loaded.is_stored
+        assert loaded_user is None
+
+
+@microtest.test
+def test_signed_sessions(app, db):
+    with app.app_context():
+        app.config['SESSION_BACKEND'] = 'signed'
+        try:
+            session = sessions.create_new_session(1)
+            cookie = sessions.session_cookie_value(session)
+            assert len(db.get_table('sessions').get_all()) == 0
+
+            loaded = sessions.load_user_session(cookie)
+            assert loaded.id == session.id
+            assert loaded.user_id == 1
+            assert loaded.csrf_token == session.csrf_token
+            assert not loaded.is_expired
+
+            tampered = bytearray(bytes.fromhex(cookie))
+            tampered[sessions.SESSIONID_RAND_BYTES] ^= 1
+            assert sessions.load_user_session(tampered.hex()).is_anonymous
+            assert sessions.load_user_session('00' * 200).is_anonymous
+
+            sessions.end_session(session.id)
+            assert sessions.load_user_session(cookie).is_anonymous
+            assert len(db.get_table('session_revocations').get_all()) == 1
+
+            other = sessions.create_new_session(2)
+            sessions.end_user_sessions(2)
+            assert sessions.load_user_session(sessions.session_cookie_value(other)).is_anonymous
+
+            sessions.get_revocation_list().reload()
+            assert sessions.load_user_session(cookie).is_anonymous
+            time.sleep(0.002)
+            newer = sessions.create_new_session(2)
+            assert sessions.load_user_session(sessions.session_cookie_value(newer)).user_id == 2
+        
+        finally:
+            app.config['SESSION_BACKEND'] = 'database'
+            sessions.revocation_lists.clear()
+
+
+@microtest.test
+def test_anonymous_requests_without_writes(app, db):
+    with app.app_context():
+        sessions_table = db.get_table('sessions')
+        client = TestClient(app)
+        
+        response = client.get('/')
+        assert 'Set-Cookie' not in response.headers
+        assert len(sessions_table.get_all()) == 0
+
+        response = client.get('/auth/login')
+        assert 'Set-Cookie' in response.headers
+        assert len(sessions_table.get_all()) == 1
+
+        response = client.get('/auth/login')
+        assert 'Set-Cookie' not in response.headers
+        assert len(sessions_table.get_all()) == 1
+
+
 @microtest.group('slow')
 @microtest.test
 def test_ending_sessions(app, db):
@@ -122,7 +336,7 @@ def test_ending_sessions(app, db):
         csrf = bytes(bytearray(32))
         uid = 1
         
-        sessions_table.insert(session_id=sid, csrf_token=csrf, expires=str(Timestamp(12)),  user_id=uid)
+        sessions_table.insert(session_id=sid, csrf_token=csrf, expires=int(Timestamp(12)),  user_id=uid)
 
         sessions.end_session(sid)
 